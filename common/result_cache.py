@@ -0,0 +1,114 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+
+try:
+    import xxhash
+except ImportError:
+    # blake2b from the standard library is the fallback; digests carry the algorithm name
+    xxhash = None
+
+# Shared by ocr/ and whisperer/: results are keyed by a hash of the input's content plus a version
+# string naming the model and every option that changes the output, so renamed or copied inputs
+# hit the cache and edited ones miss it
+DEFAULT_PATH = os.path.expanduser("~/.cache/tm_daily_ingest/results.sqlite")
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+READ_SIZE = 1024 * 1024
+
+def new_hasher():
+    if xxhash:
+        return "xxh3", xxhash.xxh3_128()
+    return "b2b", hashlib.blake2b(digest_size=16)
+
+def hash_text(text):
+    # For inputs that are not files, such as the transcript chunks sent to Bedrock
+    name, hasher = new_hasher()
+    hasher.update(text.encode('utf-8'))
+    return f"{name}:{hasher.hexdigest()}"
+
+def hash_file(file_path):
+    # Streams the file through a reusable buffer
+    name, hasher = new_hasher()
+    buffer = bytearray(READ_SIZE)
+    view = memoryview(buffer)
+    with open(file_path, 'rb', buffering=0) as f:
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            hasher.update(view[:n])
+    return f"{name}:{hasher.hexdigest()}"
+
+class ResultCache:
+    def __init__(self, path=DEFAULT_PATH, max_bytes=DEFAULT_MAX_BYTES):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.max_bytes = max_bytes
+        # Used from the OCR dispatcher and callback threads
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        # files remembers digests by path, size and mtime, so unchanged inputs are not re-read
+        self.db.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, digest TEXT)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS results (digest TEXT, version TEXT, value TEXT, size INTEGER, "
+                        "last_used REAL, PRIMARY KEY (digest, version))")
+        self.db.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+        self.db.commit()
+
+    def digest(self, file_path):
+        file_path = os.path.abspath(file_path)
+        stat = os.stat(file_path)
+        with self.lock:
+            row = self.db.execute("SELECT size, mtime_ns, digest FROM files WHERE path = ?", (file_path,)).fetchone()
+        if row and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            return row[2]
+
+        digest = hash_file(file_path)
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                            (file_path, stat.st_size, stat.st_mtime_ns, digest))
+            self.db.commit()
+        return digest
+
+    def get(self, file_path, version):
+        return self.lookup(self.digest(file_path), version)
+
+    def put(self, file_path, version, value):
+        self.store(self.digest(file_path), version, value)
+
+    def lookup(self, digest, version):
+        with self.lock:
+            row = self.db.execute("SELECT value FROM results WHERE digest = ? AND version = ?",
+                                  (digest, version)).fetchone()
+            if row is None:
+                return None
+            self.db.execute("UPDATE results SET last_used = ? WHERE digest = ? AND version = ?",
+                            (time.time(), digest, version))
+            self.db.commit()
+        return row[0]
+
+    def store(self, digest, version, value):
+        size = len(value.encode('utf-8'))
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                            (digest, version, value, size, time.time()))
+            self.evict()
+            self.db.commit()
+
+    def evict(self):
+        # Least recently used results go first, down to 90% of max_bytes
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = self.max_bytes * 0.9
+        for digest, version, size in self.db.execute(
+                "SELECT digest, version, size FROM results ORDER BY last_used").fetchall():
+            if total <= target:
+                break
+            self.db.execute("DELETE FROM results WHERE digest = ? AND version = ?", (digest, version))
+            total -= size
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,406 @@
+import os
+import json
+import math
+import bisect
+import concurrent.futures
+from collections import defaultdict
+from tokenizer import tokenize, tokenize_name, is_cjk
+from segments import CHAR_PREFIX, Segment, build_segment, merge_segments
+
+INDEX_DIRNAME = ".tm_index"
+INDEX_FILENAME = "index.json"
+# OCR output paths appended by ocr/main.py as it finishes each screenshot
+JOURNAL_FILENAME = "pending.txt"
+# Whisper transcripts with segment timings, written by whisperer/main.py into the session folders
+TRANSCRIPT_SUFFIX = "_segments.json"
+# Bump whenever the stored layout changes; older indexes are rebuilt from scratch
+INDEX_VERSION = 8
+SEGMENT_SUFFIX = ".tms"
+# Changed files are indexed this many at a time, one new segment per batch
+BATCH_SIZE = 5000
+# Tiered merging: segments are grouped by live doc count into powers of MERGE_FACTOR, and once a
+# tier holds MERGE_FACTOR segments they become one segment of the next tier. Each doc is rewritten
+# O(log N) times and a large base segment is left alone by small incremental updates
+MERGE_FACTOR = 4
+# A segment with more than this fraction of its docs deleted is rewritten on its own
+MAX_DELETED_FRACTION = 0.5
+
+def read_transcript(file_path):
+    # Every Whisper segment becomes its own document so a hit points at a moment, not a whole recording
+    with open(file_path, 'r', encoding='utf-8') as file:
+        transcript = json.load(file)
+
+    media_path = os.path.join(os.path.dirname(file_path), transcript["media"])
+    documents = []
+    for segment in transcript["segments"]:
+        text = segment["text"].strip()
+        extra = {"kind": "transcript", "media": media_path, "start": segment["start"], "end": segment["end"]}
+        documents.append((extra, text, tokenize(text)))
+    return documents
+
+def read_document(file_path):
+    # Returns (extra metadata, text, tokens) for every document stored in the file. A file that can't
+    # be read or parsed is indexed as empty, so one bad file doesn't stop the update; it is read
+    # again once it changes
+    try:
+        if file_path.endswith(TRANSCRIPT_SUFFIX):
+            return read_transcript(file_path)
+        with open(file_path, 'r', encoding='utf-8') as file:
+            content = file.read()
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f"Error reading {file_path}: {e}")
+        return []
+    return [({}, content, tokenize(content))]
+
+def read_changed(changed, num_workers=4):
+    # Files are read only when they are new or changed
+    with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+        documents = executor.map(read_document, [file_path for file_path, stat in changed])
+        return [(file_path, stat, parts) for (file_path, stat), parts in zip(changed, documents)]
+
+def transcript_files(transcript_root):
+    # Session folders sit directly under Downloads; tm_daily_ingest holds the OCR output instead
+    if not transcript_root or not os.path.isdir(transcript_root):
+        return []
+    found = []
+    for entry in os.scandir(transcript_root):
+        if entry.is_dir() and "tm_daily_ingest" not in entry.name:
+            for file in os.scandir(entry.path):
+                if file.name.endswith(TRANSCRIPT_SUFFIX):
+                    found.append(file.path)
+    return found
+
+def folder_terms(file_path):
+    folder_name = os.path.basename(os.path.dirname(file_path))
+    return [t.lower() for t in tokenize_name(folder_name)]
+
+def take_journal(index_dir):
+    # Claim the journal by renaming it, so lines the OCR daemon appends meanwhile go to a fresh file
+    journal = os.path.join(index_dir, JOURNAL_FILENAME)
+    claimed = journal + ".claimed"
+    try:
+        os.replace(journal, claimed)
+    except FileNotFoundError:
+        return []
+    with open(claimed, 'r', encoding='utf-8') as f:
+        paths = [line.strip() for line in f if line.strip()]
+    os.remove(claimed)
+    return list(dict.fromkeys(paths))
+
+def batches(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+class InvertedIndex:
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        # Open segments as [name, base doc id, Segment], ordered by base; a segment's docs
+        # get the global ids base .. base + doc_count - 1
+        self.segments = []
+        # Global ids of docs that were removed or replaced since their segment was written
+        self.deleted = set()
+        self.next_id = 0
+        self.next_segment = 0
+        self.doc_count = 0
+        # Sum of all live document lengths, kept up to date for the BM25 average
+        self.total_length = 0
+        # path -> [mtime, size] of files that produced no documents (e.g. a transcript of a silent
+        # recording), so they are not read again on every scan
+        self.empty = {}
+
+    @classmethod
+    def load(cls, index_dir):
+        index = cls(index_dir)
+        index_file = os.path.join(index_dir, INDEX_FILENAME)
+        if not os.path.exists(index_file):
+            return index
+
+        with open(index_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+
+        if data.get("version") != INDEX_VERSION:
+            print(f"Index format changed, rebuilding {index_dir}")
+            return index
+
+        # Segments are memory-mapped, so opening costs the same whatever the corpus size
+        index.segments = [[name, base, Segment(os.path.join(index_dir, name))] for name, base in data["segments"]]
+        index.deleted = set(data["deleted"])
+        index.next_id = data["next_id"]
+        index.next_segment = data["next_segment"]
+        index.doc_count = data["doc_count"]
+        index.total_length = data["total_length"]
+        index.empty = data.get("empty", {})
+        return index
+
+    def save(self):
+        os.makedirs(self.index_dir, exist_ok=True)
+        index_file = os.path.join(self.index_dir, INDEX_FILENAME)
+        tmp_file = index_file + ".tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({
+                "version": INDEX_VERSION,
+                "segments": [[name, base] for name, base, segment in self.segments],
+                "deleted": sorted(self.deleted),
+                "next_id": self.next_id,
+                "next_segment": self.next_segment,
+                "doc_count": self.doc_count,
+                "total_length": self.total_length,
+                "empty": self.empty,
+            }, f)
+        # Swap in atomically so a crash never leaves a half-written index
+        os.replace(tmp_file, index_file)
+
+        # Drop segment files that were merged away or left behind by an interrupted run
+        live = {name for name, base, segment in self.segments}
+        for name in os.listdir(self.index_dir):
+            if name.endswith(SEGMENT_SUFFIX) and name not in live:
+                os.remove(os.path.join(self.index_dir, name))
+
+    def close(self):
+        for name, base, segment in self.segments:
+            segment.close()
+
+    def new_segment_name(self):
+        name = f"seg_{self.next_segment:06d}{SEGMENT_SUFFIX}"
+        self.next_segment += 1
+        return name
+
+    def locate(self, doc_id):
+        # Map a global doc id to (segment, local id)
+        i = bisect.bisect_right([base for name, base, segment in self.segments], doc_id) - 1
+        name, base, segment = self.segments[i]
+        return segment, doc_id - base
+
+    def live_docs(self):
+        for name, base, segment in self.segments:
+            for local_id in range(segment.doc_count):
+                if base + local_id not in self.deleted:
+                    yield base + local_id, segment, local_id
+
+    def find_path(self, file_path):
+        doc_ids = []
+        for name, base, segment in self.segments:
+            doc_ids.extend(base + local_id for local_id in segment.find_path(file_path)
+                           if base + local_id not in self.deleted)
+        return doc_ids
+
+    def delete(self, doc_id):
+        segment, local_id = self.locate(doc_id)
+        self.deleted.add(doc_id)
+        self.doc_count -= 1
+        self.total_length -= segment.length(local_id)
+
+    def add_segment(self, documents):
+        name = self.new_segment_name()
+        count = build_segment(os.path.join(self.index_dir, name), documents)
+        self.segments.append([name, self.next_id, Segment(os.path.join(self.index_dir, name))])
+        self.next_id += count
+        self.doc_count += count
+        self.total_length += sum(len(tokens) for metadata, text, tokens, folder_tokens in documents)
+
+    def live_counts(self):
+        # Live docs per segment, in segment order
+        bases = [base for name, base, segment in self.segments]
+        deleted = [0] * len(self.segments)
+        for doc_id in self.deleted:
+            deleted[bisect.bisect_right(bases, doc_id) - 1] += 1
+        return [segment.doc_count - count for (name, base, segment), count in zip(self.segments, deleted)]
+
+    def plan_merge(self):
+        # Returns the segment entries to merge next, or None when the segments are in shape
+        tiers = defaultdict(list)
+        for entry, live in zip(self.segments, self.live_counts()):
+            if live < entry[2].doc_count * (1 - MAX_DELETED_FRACTION):
+                return [entry]
+            tiers[0 if live < MERGE_FACTOR else int(math.log(live, MERGE_FACTOR))].append(entry)
+        for tier in sorted(tiers):
+            if len(tiers[tier]) >= MERGE_FACTOR:
+                return tiers[tier]
+        return None
+
+    def build_merge(self, entries):
+        # Writes the merged segment file and returns its name. Only reads the segments, so it can run
+        # while queries are answered; the index must not change until finish_merge
+        name = self.new_segment_name()
+        merge_segments(os.path.join(self.index_dir, name),
+                       [(segment, base) for segment_name, base, segment in entries], self.deleted)
+        return name
+
+    def finish_merge(self, entries, name):
+        # Swaps the merged segment in; it gets fresh ids after every existing one, so bases stay sorted
+        ranges = [range(base, base + segment.doc_count) for segment_name, base, segment in entries]
+        self.deleted = {doc_id for doc_id in self.deleted if not any(doc_id in r for r in ranges)}
+        for entry in entries:
+            self.segments.remove(entry)
+            entry[2].close()
+        merged = Segment(os.path.join(self.index_dir, name))
+        if merged.doc_count:
+            self.segments.append([name, self.next_id, merged])
+            self.next_id += merged.doc_count
+        else:
+            # Nothing left alive; the file is removed by the next save()
+            merged.close()
+
+    def merge(self):
+        # Keep the number of segments bounded so lookups don't fan out forever
+        while True:
+            entries = self.plan_merge()
+            if entries is None:
+                return
+            self.finish_merge(entries, self.build_merge(entries))
+
+    def scan(self, directory, transcript_root=None):
+        # Only stat the tree; returns (path, stat) pairs for new or changed files and the removed paths
+        seen = {}
+        for root, dirs, files in os.walk(directory):
+            dirs[:] = [d for d in dirs if d != INDEX_DIRNAME]
+            for file in files:
+                if file.endswith('.txt'):
+                    file_path = os.path.join(root, file)
+                    seen[file_path] = os.stat(file_path)
+        for file_path in transcript_files(transcript_root):
+            seen[file_path] = os.stat(file_path)
+
+        indexed = {}
+        for doc_id, segment, local_id in self.live_docs():
+            metadata = segment.metadata(local_id)
+            indexed[metadata["path"]] = (metadata["mtime"], metadata["size"])
+        for file_path, (mtime, size) in self.empty.items():
+            indexed[file_path] = (mtime, size)
+
+        removed = [path for path in indexed if path not in seen]
+
+        changed = []
+        for file_path, stat in seen.items():
+            if indexed.get(file_path) != (stat.st_mtime, stat.st_size):
+                changed.append((file_path, stat))
+
+        return changed, removed
+
+    def scan_paths(self, paths):
+        # Like scan(), but only for the given files (e.g. from the OCR journal) instead of the whole tree
+        changed, removed = [], []
+        for file_path in paths:
+            doc_ids = self.find_path(file_path)
+            try:
+                stat = os.stat(file_path)
+            except FileNotFoundError:
+                if doc_ids or file_path in self.empty:
+                    removed.append(file_path)
+                continue
+            if doc_ids:
+                metadata = self.metadata(doc_ids[0])
+                indexed = (metadata["mtime"], metadata["size"])
+            else:
+                indexed = tuple(self.empty.get(file_path, ())) or None
+            if indexed != (stat.st_mtime, stat.st_size):
+                changed.append((file_path, stat))
+        return changed, removed
+
+    def apply(self, changed_documents, removed):
+        os.makedirs(self.index_dir, exist_ok=True)
+        for file_path in removed + [file_path for file_path, stat, parts in changed_documents]:
+            self.empty.pop(file_path, None)
+            for doc_id in self.find_path(file_path):
+                self.delete(doc_id)
+
+        documents = []
+        for file_path, stat, parts in changed_documents:
+            if not parts:
+                self.empty[file_path] = [stat.st_mtime, stat.st_size]
+            for extra, text, tokens in parts:
+                metadata = {"path": file_path, "mtime": stat.st_mtime, "size": stat.st_size, **extra}
+                documents.append((metadata, text, tokens, folder_terms(file_path)))
+        if documents:
+            self.add_segment(documents)
+
+    def update(self, directory, num_workers=4, transcript_root=None, full=True):
+        # A full update walks the tree; otherwise only files named in the OCR journal are checked
+        journal_paths = take_journal(self.index_dir)
+        if full:
+            changed, removed = self.scan(directory, transcript_root)
+        else:
+            changed, removed = self.scan_paths(journal_paths)
+        self.apply([], removed)
+        for batch in batches(changed, BATCH_SIZE):
+            self.apply(read_changed(batch, num_workers), [])
+        self.merge()
+        return len(changed), len(removed)
+
+    def lookup(self, word, match_case=False):
+        # Returns [doc id, [positions]] pairs for the word
+        term = word.lower()
+        if len(term) == 1 and is_cjk(term):
+            return self.lookup_cjk_char(term)
+
+        postings = []
+        for name, base, segment in self.segments:
+            postings.extend([base + local_id, positions] for local_id, positions in segment.postings(term)
+                            if base + local_id not in self.deleted)
+        if not match_case:
+            return postings
+        # Case is folded in the index, so exact-case matches are checked against the stored text
+        return [p for p in postings if word in tokenize(self.text_of(p[0]))]
+
+    def lookup_cjk_char(self, char):
+        # CJK text is indexed as bigrams, so a lone character matches every bigram containing it;
+        # those positions are stored together under the character's own term
+        postings = []
+        for name, base, segment in self.segments:
+            postings.extend([base + local_id, positions] for local_id, positions in segment.postings(CHAR_PREFIX + char)
+                            if base + local_id not in self.deleted)
+        return postings
+
+    def lookup_phrase(self, words, match_case=False):
+        # Returns [doc id, occurrence count] pairs for documents containing the words consecutively
+        if len(words) == 1:
+            return [[doc_id, len(positions)] for doc_id, positions in self.lookup(words[0], match_case)]
+
+        postings = [dict((doc_id, positions) for doc_id, positions in self.lookup(word, match_case)) for word in words]
+
+        # Intersect starting from the rarest word, then verify positions only for the survivors
+        candidates = set(min(postings, key=len))
+        for posting in sorted(postings, key=len):
+            candidates.intersection_update(posting)
+            if not candidates:
+                return []
+
+        matches = []
+        for doc_id in sorted(candidates):
+            position_sets = [set(posting[doc_id]) for posting in postings[1:]]
+            count = sum(1 for start in postings[0][doc_id]
+                        if all(start + offset in positions for offset, positions in enumerate(position_sets, 1)))
+            if count:
+                matches.append([doc_id, count])
+        return matches
+
+    def lookup_folder(self, word):
+        # Folder names are always matched case-insensitively
+        return [doc_id for doc_id, positions in self.lookup("#" + word)]
+
+    def metadata(self, doc_id):
+        segment, local_id = self.locate(doc_id)
+        return segment.metadata(local_id)
+
+    def doc_length(self, doc_id):
+        segment, local_id = self.locate(doc_id)
+        return segment.length(local_id)
+
+    def text_of(self, doc_id):
+        segment, local_id = self.locate(doc_id)
+        return segment.text(local_id)
+
+    def average_length(self):
+        return self.total_length / self.doc_count if self.doc_count else 0
+
+def open_index(directory, update=True, rebuild=False, num_workers=4, transcript_root=None):
+    index_dir = os.path.join(directory, INDEX_DIRNAME)
+    index = InvertedIndex(index_dir) if rebuild else InvertedIndex.load(index_dir)
+
+    # Even without a full update, files the OCR daemon reported are picked up
+    changed, removed = index.update(directory, num_workers, transcript_root, full=update or rebuild)
+    if changed or removed or rebuild:
+        index.save()
+    print(f"Index updated: {changed} files (re)indexed, {removed} removed, {index.doc_count} total.")
+
+    return index
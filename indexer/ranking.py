@@ -0,0 +1,63 @@
+import math
+import heapq
+from collections import defaultdict
+from tokenizer import parse_query, tokenize_name
+
+# Standard BM25 parameters
+K1 = 1.2
+B = 0.75
+# A folder-name hit counts as this many occurrences in the body text
+FOLDER_WEIGHT = 2.0
+
+def idf(doc_count, doc_freq):
+    return math.log(1 + (doc_count - doc_freq + 0.5) / (doc_freq + 0.5))
+
+def folder_matches(index, words):
+    # A phrase hits the folder field when all of its words appear in the folder name; query words
+    # are split the same way as folder names, so "re_Invent" matches AWS_re_Invent_2024_Keynote
+    words = [part for word in words for part in tokenize_name(word)]
+    if not words:
+        return set()
+    doc_ids = set(index.lookup_folder(words[0]))
+    for word in words[1:]:
+        doc_ids.intersection_update(index.lookup_folder(word))
+    return doc_ids
+
+def bm25_search(index, query_groups, match_case=False, limit=100, k1=K1, b=B, folder_weight=FOLDER_WEIGHT):
+    doc_count = index.doc_count
+    if doc_count == 0:
+        return []
+    avg_length = index.average_length() or 1
+
+    scores = defaultdict(float)
+    for words in {tuple(group) for group in query_groups}:
+        # Each query group (word, CJK run or quoted phrase) is scored as one BM25 term,
+        # with its phrase occurrence count as the term frequency.
+        # BM25F: the folder name is a second field whose frequency is folded into the body frequency
+        frequencies = defaultdict(float)
+        for doc_id, tf in index.lookup_phrase(words, match_case):
+            frequencies[doc_id] += tf
+        for doc_id in folder_matches(index, words):
+            frequencies[doc_id] += folder_weight
+
+        if not frequencies:
+            continue
+
+        word_idf = idf(doc_count, len(frequencies))
+        for doc_id, tf in frequencies.items():
+            norm = k1 * (1 - b + b * index.doc_length(doc_id) / avg_length)
+            scores[doc_id] += word_idf * tf * (k1 + 1) / (tf + norm)
+
+    # Bounded heap instead of sorting every matching document
+    return heapq.nlargest(limit, scores.items(), key=lambda x: x[1])
+
+def search(index, search_key, match_case=False, limit=100):
+    # Each hit is the document metadata (path, plus media/start/end for transcript segments)
+    # with its doc id and score
+    hits = []
+    for doc_id, score in bm25_search(index, parse_query(search_key), match_case, limit):
+        hit = index.metadata(doc_id)
+        hit["id"] = doc_id
+        hit["score"] = round(score, 3)
+        hits.append(hit)
+    return hits
@@ -0,0 +1,193 @@
+import os
+import re
+import html
+import hashlib
+from urllib.parse import quote
+from tokenizer import RUN_RE
+
+try:
+    from PIL import Image
+except ImportError:
+    # Without Pillow the report links the screenshots but shows no previews
+    Image = None
+
+THUMBNAIL_DIRNAME = "thumbnails"
+THUMBNAIL_WIDTH = 320
+SNIPPET_WIDTH = 240
+SCREENSHOT_EXTENSIONS = ('.png', '.jpg')
+
+def file_url(path):
+    return "file://" + path
+
+def format_timestamp(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+
+def screenshot_path(file_path):
+    # Find the corresponding screenshot: PNG captures, or JPEG keyframes extracted from recordings
+    stem = file_path.rsplit('.', 1)[0]
+    for extension in SCREENSHOT_EXTENSIONS:
+        if os.path.exists(stem + extension):
+            return stem + extension
+    return None
+
+def thumbnail_path(png_path, thumbnail_dir):
+    # One cached thumbnail per screenshot, regenerated only when the screenshot changes
+    if Image is None:
+        return None
+
+    name = hashlib.sha1(png_path.encode('utf-8')).hexdigest() + ".jpg"
+    thumb_path = os.path.join(thumbnail_dir, name)
+    try:
+        if os.path.getmtime(thumb_path) >= os.path.getmtime(png_path):
+            return thumb_path
+    except OSError:
+        pass
+
+    os.makedirs(thumbnail_dir, exist_ok=True)
+    try:
+        with Image.open(png_path) as image:
+            image.draft('RGB', (THUMBNAIL_WIDTH, THUMBNAIL_WIDTH * 4))
+            image = image.convert('RGB')
+            image.thumbnail((THUMBNAIL_WIDTH, THUMBNAIL_WIDTH * 4))
+            tmp_path = thumb_path + ".tmp"
+            image.save(tmp_path, "JPEG", quality=70)
+            os.replace(tmp_path, thumb_path)
+    except OSError as e:
+        print(f"Error creating thumbnail for {png_path}: {e}")
+        return None
+    return thumb_path
+
+def make_snippet(text, search_key, width=SNIPPET_WIDTH):
+    # Highlight whole query runs (words and CJK runs) around the first hit in the indexed text
+    runs = sorted(set(RUN_RE.findall(search_key)), key=len, reverse=True)
+    if not runs:
+        return html.escape(text[:width])
+    pattern = re.compile("|".join(re.escape(run) for run in runs), re.IGNORECASE)
+
+    match = pattern.search(text)
+    start = max(0, match.start() - width // 3) if match else 0
+    snippet = text[start:start + width]
+
+    parts = []
+    last = 0
+    for hit in pattern.finditer(snippet):
+        parts.append(html.escape(snippet[last:hit.start()]))
+        parts.append(f"<mark>{html.escape(hit.group())}</mark>")
+        last = hit.end()
+    parts.append(html.escape(snippet[last:]))
+
+    prefix = "&hellip;" if start > 0 else ""
+    suffix = "&hellip;" if start + width < len(text) else ""
+    return prefix + "".join(parts).replace("\n", " ") + suffix
+
+def render_html_page(search_key, hits, page, page_count, page_href, image_src=file_url, thumbnail_src=None):
+    # hits are search hits with "snippet" and "png" added, for one page; thumbnail_src maps a
+    # screenshot to its preview URL, or None when there is no preview
+    html_content = f"""
+    <html>
+    <head>
+        <meta charset="utf-8">
+        <title>Search Results for "{html.escape(search_key)}" (page {page}/{page_count})</title>
+        <style>
+            body {{ font-family: Arial, sans-serif; }}
+            .result {{ margin-bottom: 20px; }}
+            .snippet {{ white-space: pre-wrap; }}
+            img {{ max-width: 100%; height: auto; }}
+            .nav a {{ margin: 0 4px; }}
+        </style>
+    </head>
+    <body>
+        <h1>Search Results for "{html.escape(search_key)}"</h1>
+    """
+
+    nav = ['<p class="nav">']
+    for number in range(1, page_count + 1):
+        if number == page:
+            nav.append(f"<b>{number}</b>")
+        else:
+            nav.append(f'<a href="{html.escape(page_href(number))}">{number}</a>')
+    nav.append("</p>")
+    nav_html = "".join(nav)
+
+    parts = [html_content, nav_html]
+    for hit in hits:
+        file_path, png_path = hit["path"], hit["png"]
+        if hit.get("kind") == "transcript":
+            # Media fragment URLs make the player start at the matching segment
+            media = hit["media"]
+            timestamp = f'{format_timestamp(hit["start"])} - {format_timestamp(hit["end"])}'
+            parts.append(f"""
+        <div class="result">
+            <h2>{html.escape(os.path.basename(media))} [{timestamp}] (Score: {hit["score"]})</h2>
+            <p>Recording: <a href="file://{html.escape(media)}#t={hit["start"]:.2f}">{html.escape(media)} at {timestamp}</a></p>
+            <p class="snippet">{hit["snippet"]}</p>
+        </div>""")
+            continue
+
+        parts.append(f"""
+        <div class="result">
+            <h2>{html.escape(file_path)} (Score: {hit["score"]})</h2>
+            <p>Text file: <a href="file://{html.escape(file_path)}">{html.escape(file_path)}</a></p>
+            <p class="snippet">{hit["snippet"]}</p>
+        """)
+
+        if png_path is None:
+            parts.append('<p>No corresponding screenshot found.</p>')
+        else:
+            # The full-resolution screenshot is only fetched once the preview is clicked
+            thumb_src = thumbnail_src(png_path) if thumbnail_src else None
+            preview = f'<img src="{html.escape(thumb_src)}" loading="lazy" alt="Thumbnail">' if thumb_src else "Show screenshot"
+            parts.append(f'<a href="#" class="shot" data-full="{html.escape(image_src(png_path))}">{preview}</a>')
+
+        parts.append('</div>')
+
+    parts.append(nav_html)
+    parts.append("""
+    <script>
+        document.addEventListener('click', function (event) {
+            var link = event.target.closest('a.shot');
+            if (!link) return;
+            event.preventDefault();
+            var image = document.createElement('img');
+            image.src = link.dataset.full;
+            image.alt = 'Related image';
+            link.replaceWith(image);
+        });
+    </script>
+    </body>
+    </html>
+    """)
+    return "".join(parts)
+
+def build_hits(search_key, results, index):
+    return [dict(hit, snippet=make_snippet(index.text_of(hit["id"]), search_key),
+                 png=None if hit.get("kind") == "transcript" else screenshot_path(hit["path"]))
+            for hit in results]
+
+def page_count(results, page_size):
+    return max(1, (len(results) + page_size - 1) // page_size)
+
+def page_filename(search_key, page):
+    return f"{search_key}.html" if page == 1 else f"{search_key}_{page}.html"
+
+def create_html_report(search_key, results, project_directory, index, page_size=50):
+    thumbnail_dir = os.path.join(index.index_dir, THUMBNAIL_DIRNAME)
+    pages = page_count(results, page_size)
+
+    def thumbnail_src(png_path):
+        thumb_path = thumbnail_path(png_path, thumbnail_dir)
+        return file_url(thumb_path) if thumb_path else None
+
+    for page in range(1, pages + 1):
+        page_results = results[(page - 1) * page_size:page * page_size]
+        hits = build_hits(search_key, page_results, index)
+        content = render_html_page(search_key, hits, page, pages, lambda number: quote(page_filename(search_key, number)),
+                                   thumbnail_src=thumbnail_src)
+        with open(os.path.join(project_directory, page_filename(search_key, page)), 'w', encoding='utf-8') as f:
+            f.write(content)
+
+    filepath = os.path.join(project_directory, page_filename(search_key, 1))
+    print(f"HTML report generated: {filepath} ({pages} pages)")
+    return filepath
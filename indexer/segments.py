@@ -0,0 +1,275 @@
+import os
+import json
+import mmap
+import zlib
+import heapq
+import struct
+import shutil
+import tempfile
+from array import array
+from tokenizer import is_cjk
+
+# Segment file layout (native byte order, every section padded to 8 bytes):
+#   header: magic, term count, doc count, then the start offset of each section and the file end
+#   term_offsets  Q x (terms + 1)  byte offsets into term_blob
+#   term_blob     UTF-8 terms, sorted bytewise
+#   post_offsets  Q x (terms + 1)  byte offsets into post_blob
+#   post_blob     per term and doc: varint(doc delta), varint(tf), tf x varint(position delta)
+#   doc_offsets   Q x (docs + 1)   byte offsets into doc_blob
+#   doc_blob      one JSON metadata record per doc (path, mtime, size), docs sorted by path
+#   lengths       I x docs         token count per doc, for BM25
+#   text_offsets  Q x (docs + 1)   byte offsets into text_blob
+#   text_blob     zlib-compressed OCR text per doc, for snippets
+MAGIC = b"TMSEG001"
+SECTION_COUNT = 9
+HEADER = struct.Struct(f"<8sQQ{SECTION_COUNT + 1}Q")
+# Every CJK character also gets a term "@<char>" listing the positions of the bigrams (or lone
+# character tokens) containing it, so a one-character query is a single dictionary lookup
+CHAR_PREFIX = "@"
+
+def encode_varint(value, out):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def decode_varints(data):
+    values = []
+    value = 0
+    shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            values.append(value)
+            value = 0
+            shift = 0
+    return values
+
+def encode_postings(postings):
+    # postings: [(doc id, [positions])] sorted by doc id, positions ascending
+    out = bytearray()
+    previous_doc = 0
+    for doc_id, positions in postings:
+        encode_varint(doc_id - previous_doc, out)
+        encode_varint(len(positions), out)
+        previous_position = 0
+        for position in positions:
+            encode_varint(position - previous_position, out)
+            previous_position = position
+        previous_doc = doc_id
+    return out
+
+def decode_postings(data):
+    values = decode_varints(data)
+    postings = []
+    doc_id = 0
+    i = 0
+    while i < len(values):
+        doc_id += values[i]
+        tf = values[i + 1]
+        positions = []
+        position = 0
+        for delta in values[i + 2:i + 2 + tf]:
+            position += delta
+            positions.append(position)
+        postings.append([doc_id, positions])
+        i += 2 + tf
+    return postings
+
+class BlobWriter:
+    # Streams a variable-length section to a temporary file, keeping only its offsets in memory
+    def __init__(self):
+        self.file = tempfile.TemporaryFile()
+        self.offsets = array('Q', [0])
+
+    def append(self, data):
+        self.file.write(data)
+        self.offsets.append(self.offsets[-1] + len(data))
+
+def padding(size):
+    return b"\0" * (-size % 8)
+
+def write_segment(path, docs, term_postings):
+    # docs: [(metadata dict, length, compressed text)] in local id order (sorted by path);
+    # term_postings: (term, [(local id, [positions])]) pairs in bytewise term order
+    terms, postings_blob, metadata_blob, texts = BlobWriter(), BlobWriter(), BlobWriter(), BlobWriter()
+    for term, postings in term_postings:
+        terms.append(term.encode('utf-8'))
+        postings_blob.append(encode_postings(postings))
+
+    lengths = array('I')
+    for metadata, length, compressed_text in docs:
+        metadata_blob.append(json.dumps(metadata, ensure_ascii=False).encode('utf-8'))
+        lengths.append(length)
+        texts.append(compressed_text)
+
+    sections = [terms.offsets, terms, postings_blob.offsets, postings_blob, metadata_blob.offsets,
+                metadata_blob, lengths, texts.offsets, texts]
+    starts = [HEADER.size]
+    for section in sections:
+        size = len(section) * section.itemsize if isinstance(section, array) else section.offsets[-1]
+        starts.append(starts[-1] + size + len(padding(size)))
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(terms.offsets) - 1, len(lengths), *starts))
+        for section in sections:
+            if isinstance(section, array):
+                data_size = len(section) * section.itemsize
+                section.tofile(f)
+            else:
+                data_size = section.offsets[-1]
+                section.file.seek(0)
+                shutil.copyfileobj(section.file, f)
+                section.file.close()
+            f.write(padding(data_size))
+    os.replace(tmp_path, path)
+
+def build_segment(path, documents):
+    # documents: [(metadata, text, tokens, folder_tokens)]; folder tokens are stored as "#term",
+    # CJK characters as "@char"
+    documents = sorted(documents, key=lambda d: d[0]["path"])
+    terms = {}
+    docs = []
+    for doc_id, (metadata, text, tokens, folder_tokens) in enumerate(documents):
+        for position, token in enumerate(tokens):
+            terms.setdefault(token.lower(), {}).setdefault(doc_id, []).append(position)
+            if is_cjk(token):
+                for char in set(token):
+                    terms.setdefault(CHAR_PREFIX + char, {}).setdefault(doc_id, []).append(position)
+        for token in folder_tokens:
+            terms.setdefault("#" + token.lower(), {}).setdefault(doc_id, [0])
+        docs.append((metadata, len(tokens), zlib.compress(text.encode('utf-8'))))
+
+    term_postings = ((term, sorted(terms[term].items()))
+                     for term in sorted(terms, key=lambda t: t.encode('utf-8')))
+    write_segment(path, docs, term_postings)
+    return len(docs)
+
+class Segment:
+    def __init__(self, file_path):
+        self.file_path = file_path
+        with open(file_path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        header = HEADER.unpack_from(self.mmap, 0)
+        if header[0] != MAGIC:
+            raise ValueError(f"Not an index segment: {file_path}")
+        self.term_count, self.doc_count = header[1], header[2]
+        starts = header[3:]
+
+        view = memoryview(self.mmap)
+        sections = [view[starts[i]:starts[i + 1]] for i in range(SECTION_COUNT)]
+        self.term_offsets = sections[0].cast('Q')[:self.term_count + 1]
+        self.term_blob = sections[1]
+        self.post_offsets = sections[2].cast('Q')[:self.term_count + 1]
+        self.post_blob = sections[3]
+        self.doc_offsets = sections[4].cast('Q')[:self.doc_count + 1]
+        self.doc_blob = sections[5]
+        self.lengths = sections[6][:self.doc_count * 4].cast('I')
+        self.text_offsets = sections[7].cast('Q')[:self.doc_count + 1]
+        self.text_blob = sections[8]
+
+    def close(self):
+        for name in ("term_offsets", "term_blob", "post_offsets", "post_blob", "doc_offsets",
+                     "doc_blob", "lengths", "text_offsets", "text_blob"):
+            getattr(self, name).release()
+        self.mmap.close()
+
+    def term(self, i):
+        return bytes(self.term_blob[self.term_offsets[i]:self.term_offsets[i + 1]])
+
+    def find_term(self, term):
+        # Binary search over the sorted term dictionary, straight from the mapped file
+        key = term.encode('utf-8')
+        lo, hi = 0, self.term_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.term(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.term_count and self.term(lo) == key:
+            return lo
+        return None
+
+    def postings_at(self, i):
+        return decode_postings(self.post_blob[self.post_offsets[i]:self.post_offsets[i + 1]])
+
+    def postings(self, term):
+        i = self.find_term(term)
+        return [] if i is None else self.postings_at(i)
+
+    def iter_terms(self):
+        for i in range(self.term_count):
+            yield self.term(i).decode('utf-8'), i
+
+    def metadata(self, doc_id):
+        return json.loads(bytes(self.doc_blob[self.doc_offsets[doc_id]:self.doc_offsets[doc_id + 1]]))
+
+    def path(self, doc_id):
+        return self.metadata(doc_id)["path"]
+
+    def length(self, doc_id):
+        return self.lengths[doc_id]
+
+    def compressed_text(self, doc_id):
+        return bytes(self.text_blob[self.text_offsets[doc_id]:self.text_offsets[doc_id + 1]])
+
+    def text(self, doc_id):
+        return zlib.decompress(self.compressed_text(doc_id)).decode('utf-8')
+
+    def find_path(self, path):
+        # Docs are sorted by path, so every doc for a path is one contiguous run
+        lo, hi = 0, self.doc_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.path(mid) < path:
+                lo = mid + 1
+            else:
+                hi = mid
+        hi = lo
+        while hi < self.doc_count and self.path(hi) == path:
+            hi += 1
+        return range(lo, hi)
+
+def merge_segments(path, segments, deleted):
+    # segments: [(Segment, base id)]; deleted holds global ids. Live docs are renumbered in path
+    # order and posting lists are merged term by term, so memory stays bounded by one term.
+    def live_docs(n, segment, base):
+        for doc_id in range(segment.doc_count):
+            if base + doc_id not in deleted:
+                yield segment.path(doc_id), n, doc_id
+
+    def segment_terms(n, segment):
+        # Terms are compared as UTF-8 bytes to match the on-disk order
+        for term, i in segment.iter_terms():
+            yield term.encode('utf-8'), term, n, i
+
+    live = heapq.merge(*[live_docs(n, segment, base) for n, (segment, base) in enumerate(segments)])
+    remaps = [{} for _ in segments]
+    docs = []
+    for new_id, (doc_path, n, doc_id) in enumerate(live):
+        segment = segments[n][0]
+        remaps[n][doc_id] = new_id
+        # Texts are copied still compressed
+        docs.append((segment.metadata(doc_id), segment.length(doc_id), segment.compressed_text(doc_id)))
+
+    def term_postings():
+        streams = [segment_terms(n, segment) for n, (segment, base) in enumerate(segments)]
+        current, merged = None, []
+        for key, term, n, i in heapq.merge(*streams):
+            if term != current:
+                if merged:
+                    yield current, sorted(merged)
+                current, merged = term, []
+            remap = remaps[n]
+            merged.extend((remap[doc_id], positions) for doc_id, positions in segments[n][0].postings_at(i)
+                          if doc_id in remap)
+        if merged:
+            yield current, sorted(merged)
+
+    write_segment(path, docs, term_postings())
+    return len(docs)
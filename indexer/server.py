@@ -0,0 +1,206 @@
+import os
+import json
+import time
+import threading
+import mimetypes
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, quote, urlencode
+from inverted_index import BATCH_SIZE, batches, read_changed, take_journal
+from ranking import search
+from report import Image, SCREENSHOT_EXTENSIONS, THUMBNAIL_DIRNAME, build_hits, page_count, render_html_page, thumbnail_path
+
+class LRUCache:
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+class SearchService:
+    def __init__(self, index, directory, num_workers=4, page_size=50, transcript_root=None, cache_size=256):
+        self.index = index
+        self.directory = directory
+        self.transcript_root = transcript_root
+        self.num_workers = num_workers
+        self.page_size = page_size
+        self.thumbnail_dir = os.path.join(index.index_dir, THUMBNAIL_DIRNAME)
+        self.cache = LRUCache(cache_size)
+        # Queries read the index while the refresh thread mutates it
+        self.lock = threading.RLock()
+
+    def search(self, search_key, match_case=False, limit=100):
+        # Lookup, search and put happen under one lock, so results computed on an index that a
+        # refresh has since changed can never be stored after the cache was cleared
+        key = (search_key, match_case, limit)
+        with self.lock:
+            results = self.cache.get(key)
+            if results is None:
+                results = search(self.index, search_key, match_case, limit)
+                self.cache.put(key, results)
+        return results
+
+    def refresh(self, full=True):
+        # Stat and tokenize outside the lock so queries keep being answered meanwhile.
+        # Between full scans only the files the OCR daemon reported in the journal are checked.
+        journal_paths = take_journal(self.index.index_dir)
+        if full:
+            changed, removed = self.index.scan(self.directory, self.transcript_root)
+        else:
+            changed, removed = self.index.scan_paths(journal_paths)
+        if not changed and not removed:
+            return False
+
+        # Doc ids change with every apply (deletes, merges), so cached rankings are dropped each time
+        with self.lock:
+            self.index.apply([], removed)
+            self.cache.clear()
+        for batch in batches(changed, BATCH_SIZE):
+            changed_documents = read_changed(batch, self.num_workers)
+            with self.lock:
+                self.index.apply(changed_documents, [])
+                self.cache.clear()
+
+        # Merged segments are written outside the lock (refresh is the only writer, and merging only
+        # reads the segments); just the swap blocks queries
+        while True:
+            with self.lock:
+                entries = self.index.plan_merge()
+            if entries is None:
+                break
+            name = self.index.build_merge(entries)
+            with self.lock:
+                self.index.finish_merge(entries, name)
+                self.cache.clear()
+
+        with self.lock:
+            self.index.save()
+
+        print(f"Index refreshed: {len(changed)} files (re)indexed, {len(removed)} removed, {self.index.doc_count} total.")
+        return True
+
+    def is_indexed_image(self, png_path):
+        with self.lock:
+            return (png_path.endswith(SCREENSHOT_EXTENSIONS)
+                    and bool(self.index.find_path(png_path.rsplit('.', 1)[0] + '.txt')))
+
+    def render_page(self, search_key, match_case, limit, page):
+        # Doc ids in cached results are only valid until the next refresh, so hold the lock throughout
+        with self.lock:
+            results = self.search(search_key, match_case, limit) if search_key else []
+            pages = page_count(results, self.page_size)
+            page = min(max(page, 1), pages)
+
+            page_results = results[(page - 1) * self.page_size:page * self.page_size]
+            hits = build_hits(search_key, page_results, self.index)
+
+        def page_href(number):
+            return "/?" + urlencode({"q": search_key, "matchcase": int(match_case), "limit": limit, "page": number})
+
+        # Thumbnails are generated when the browser asks for them, not while rendering the page
+        return render_html_page(search_key, hits, page, pages, page_href,
+                                image_src=lambda path: "/image?path=" + quote(path),
+                                thumbnail_src=(lambda path: "/thumbnail?path=" + quote(path)) if Image else None)
+
+def refresh_loop(service, interval, journal_interval=1):
+    last_full = time.monotonic()
+    while True:
+        time.sleep(journal_interval)
+        full = time.monotonic() - last_full >= interval
+        if full:
+            last_full = time.monotonic()
+        try:
+            service.refresh(full)
+        except Exception as e:
+            print(f"Error refreshing index: {e}")
+
+def make_handler(service):
+    class SearchHandler(BaseHTTPRequestHandler):
+        def send_body(self, status, content_type, body):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = parse_qs(url.query)
+            search_key = params.get("q", [""])[0]
+            match_case = params.get("matchcase", ["0"])[0] == "1"
+            try:
+                limit = int(params.get("limit", ["100"])[0])
+                page = int(params.get("page", ["1"])[0])
+            except ValueError:
+                limit, page = 100, 1
+
+            if url.path == "/search":
+                start = time.perf_counter()
+                results = service.search(search_key, match_case, limit) if search_key else []
+                body = json.dumps({
+                    "query": search_key,
+                    "elapsed_ms": round((time.perf_counter() - start) * 1000, 3),
+                    "results": [{key: value for key, value in hit.items() if key not in ("id", "mtime", "size")}
+                                for hit in results],
+                }, ensure_ascii=False).encode('utf-8')
+                self.send_body(200, "application/json; charset=utf-8", body)
+            elif url.path == "/":
+                content = service.render_page(search_key, match_case, limit, page)
+                self.send_body(200, "text/html; charset=utf-8", content.encode('utf-8'))
+            elif url.path in ("/image", "/thumbnail"):
+                # Only serve screenshots (and their thumbnails) that sit next to an indexed OCR file
+                png_path = params.get("path", [""])[0]
+                if not service.is_indexed_image(png_path):
+                    self.send_error(404)
+                    return
+                file_path = png_path if url.path == "/image" else thumbnail_path(png_path, service.thumbnail_dir)
+                if file_path is None:
+                    self.send_error(404)
+                    return
+                try:
+                    with open(file_path, 'rb') as f:
+                        body = f.read()
+                except OSError:
+                    self.send_error(404)
+                    return
+                self.send_body(200, mimetypes.guess_type(file_path)[0] or "application/octet-stream", body)
+            else:
+                self.send_error(404)
+
+        def log_message(self, format, *args):
+            pass
+
+    return SearchHandler
+
+def serve(index, directory, port=8765, refresh_interval=30, num_workers=4, page_size=50, transcript_root=None,
+          host="127.0.0.1"):
+    service = SearchService(index, directory, num_workers, page_size, transcript_root)
+
+    refresher = threading.Thread(target=refresh_loop, args=(service, refresh_interval), daemon=True)
+    refresher.start()
+
+    httpd = ThreadingHTTPServer((host, port), make_handler(service))
+    print(f"Serving search on http://{host}:{port}/?q=<searchkey> (JSON at /search?q=<searchkey>)")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        print("\nServer stopped by user.")
+    finally:
+        httpd.server_close()
@@ -0,0 +1,40 @@
+import re
+
+# Hiragana/Katakana, CJK ideographs (incl. extension A and compatibility) and Hangul
+CJK_CHARS = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af'
+# A token run is either a stretch of CJK characters or a word of any other \w characters
+RUN_RE = re.compile(rf'[{CJK_CHARS}]+|[^\W{CJK_CHARS}]+')
+CJK_RE = re.compile(rf'[{CJK_CHARS}]')
+QUOTED_RE = re.compile(r'"([^"]*)"')
+
+def is_cjk(text):
+    return CJK_RE.match(text) is not None
+
+def split_run(run):
+    # Latin words stay whole; CJK runs become overlapping character bigrams
+    if not is_cjk(run) or len(run) == 1:
+        return [run]
+    return [run[i:i + 2] for i in range(len(run) - 1)]
+
+def tokenize(text):
+    # Token positions are the list indexes, so a CJK run's bigrams sit at consecutive positions
+    tokens = []
+    for run in RUN_RE.findall(text):
+        tokens.extend(split_run(run))
+    return tokens
+
+def tokenize_name(name):
+    # Folder names built from page titles join words with underscores, which \w would keep together
+    return tokenize(name.replace('_', ' '))
+
+def parse_query(query):
+    # Each group is matched as a phrase: a quoted string, a CJK run or a single word
+    groups = []
+    for i, part in enumerate(QUOTED_RE.split(query)):
+        if i % 2 == 1:
+            tokens = tokenize(part)
+            if tokens:
+                groups.append(tokens)
+        else:
+            groups.extend(split_run(run) for run in RUN_RE.findall(part))
+    return groups
@@ -0,0 +1,47 @@
+import os
+import json
+import logging
+
+# A run appends chunk results to the markdown in order; after each append the number of chunks
+# written and the file size are saved next to it. A later run over the same chunks with the same
+# model and prompt cuts the markdown back to the saved size and continues with the next chunk
+
+class Checkpoint:
+    def __init__(self, md_file, run_key):
+        self.md_file = md_file
+        self.path = md_file + ".checkpoint"
+        self.run_key = run_key
+
+    def resume(self):
+        # Returns the number of chunks already in the markdown, 0 when starting over
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return 0
+        if state.get("key") != self.run_key:
+            logging.info(f"Checkpoint {self.path} is for other chunks or another model, starting over")
+            return 0
+        try:
+            if os.path.getsize(self.md_file) < state["size"]:
+                logging.info(f"{self.md_file} is shorter than its checkpoint, starting over")
+                return 0
+        except OSError:
+            return 0
+        # Drops anything appended after the last checkpoint, such as a chunk written just before a crash
+        with open(self.md_file, 'r+b') as f:
+            f.truncate(state["size"])
+        return state["chunks"]
+
+    def save(self, chunks):
+        state = {"key": self.run_key, "chunks": chunks, "size": os.path.getsize(self.md_file)}
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.path)
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
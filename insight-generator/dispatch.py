@@ -0,0 +1,217 @@
+import re
+import math
+import time
+import random
+import logging
+import threading
+import concurrent.futures
+
+# Token estimates without a tokenizer: a CJK character is about one token, other text about
+# CHARS_PER_TOKEN characters per token
+CJK_RE = re.compile(r'[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]')
+CHARS_PER_TOKEN = 3.5
+# Chunks are split after sentence ends and line breaks where possible
+SENTENCE_RE = re.compile(r'(?<=[。！？；!?;.\n])')
+# Error codes Bedrock returns when the account is over its request or token quota, compared in
+# lower case: errors raised mid-stream (botocore's EventStreamError) carry the stream member name,
+# e.g. throttlingException
+THROTTLE_CODES = {"throttlingexception", "toomanyrequestsexception", "serviceunavailableexception",
+                  "modelnotreadyexception", "modelstreamerrorexception"}
+MAX_ATTEMPTS = 6
+# Output markdown is written through a buffer and flushed at least this often while streaming
+BUFFER_SIZE = 64 * 1024
+FLUSH_INTERVAL = 1.0
+
+def estimate_tokens(text):
+    cjk = len(CJK_RE.findall(text))
+    return math.ceil(cjk + (len(text) - cjk) / CHARS_PER_TOKEN)
+
+def split_long(piece, max_tokens):
+    # A run without sentence punctuation (common in Whisper's Chinese output) is cut by length
+    tokens = estimate_tokens(piece)
+    if tokens <= max_tokens:
+        return [piece]
+    step = max(1, len(piece) * max_tokens // tokens)
+    return [part for start in range(0, len(piece), step) for part in split_long(piece[start:start + step], max_tokens)]
+
+def chunk_transcript(transcript, max_tokens=2000, overlap_tokens=100):
+    # Chunks of at most max_tokens, each starting with the last ~overlap_tokens of the previous one
+    pieces = [part for piece in SENTENCE_RE.split(transcript) if piece for part in split_long(piece, max_tokens)]
+    chunks = []
+    current, current_tokens = [], 0
+    for piece in pieces:
+        tokens = estimate_tokens(piece)
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append("".join(current))
+            # Carry trailing sentences over as context, leaving room for this piece
+            carried, carried_tokens = [], 0
+            for previous in reversed(current):
+                previous_tokens = estimate_tokens(previous)
+                if carried_tokens + previous_tokens > min(overlap_tokens, max_tokens - tokens):
+                    break
+                carried.insert(0, previous)
+                carried_tokens += previous_tokens
+            current, current_tokens = carried, carried_tokens
+        current.append(piece)
+        current_tokens += tokens
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+class TokenBucket:
+    # Limits tokens per minute across every thread calling acquire(). The rate is halved on
+    # throttling and recovers gradually after successful calls
+    def __init__(self, tokens_per_minute, min_tokens_per_minute=None):
+        self.max_rate = tokens_per_minute / 60
+        self.min_rate = (min_tokens_per_minute or tokens_per_minute / 16) / 60
+        self.rate = self.max_rate
+        self.capacity = tokens_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, tokens):
+        # A request larger than the bucket would never fit; it waits for a full bucket instead
+        tokens = min(tokens, self.capacity)
+        while True:
+            with self.lock:
+                self.refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(min(wait, 5))
+
+    def throttled(self):
+        with self.lock:
+            self.refill()
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = 0
+            logging.warning(f"Throttled, rate limit lowered to {self.rate * 60:.0f} tokens/min")
+
+    def succeeded(self):
+        with self.lock:
+            self.refill()
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+def is_throttle(error):
+    # botocore's ClientError (and the stub client's errors) carry the service error code
+    code = getattr(error, "response", {}).get("Error", {}).get("Code") or ""
+    return code.lower() in THROTTLE_CODES
+
+def call_with_backoff(call, prompt, limiter, cost, restart=None):
+    for attempt in range(MAX_ATTEMPTS):
+        limiter.acquire(cost)
+        try:
+            result = call(prompt)
+        except Exception as e:
+            if not is_throttle(e) or attempt == MAX_ATTEMPTS - 1:
+                raise
+            limiter.throttled()
+            if restart:
+                restart()
+            # Exponential backoff with full jitter, on top of the lowered rate
+            time.sleep(random.uniform(0, min(60, 2 ** attempt)))
+            continue
+        limiter.succeeded()
+        return result
+
+class OrderedWriter:
+    # Appends chunk results to the markdown in transcript order while requests finish in any order.
+    # The earliest unfinished chunk streams straight into the file as text() arrives; text for later
+    # chunks is held until their turn. Writes are buffered and flushed every FLUSH_INTERVAL seconds
+    # and after each chunk, when finished(index, content) is called (content is None if it failed)
+    def __init__(self, file_path, finished):
+        self.file = open(file_path, 'ab', buffering=BUFFER_SIZE)
+        self.finished = finished
+        self.partial = {}
+        self.done = {}
+        self.next_index = 0
+        # Where the chunk being streamed starts, so a retried or failed chunk can be cut off
+        self.head_start = self.file.tell()
+        self.head_chars = 0
+        self.flushed = time.monotonic()
+        self.lock = threading.Lock()
+
+    def emit(self, text):
+        self.file.write(text.encode('utf-8'))
+        self.head_chars += len(text)
+        if time.monotonic() - self.flushed > FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        self.file.flush()
+        self.flushed = time.monotonic()
+
+    def text(self, index, text):
+        with self.lock:
+            if index == self.next_index:
+                self.emit(text)
+            else:
+                self.partial.setdefault(index, []).append(text)
+
+    def restart(self, index):
+        # Drops what a chunk has streamed so far, before it is retried
+        with self.lock:
+            if index == self.next_index:
+                self.cut_head()
+            else:
+                self.partial.pop(index, None)
+
+    def cut_head(self):
+        self.file.flush()
+        self.file.truncate(self.head_start)
+        self.file.seek(0, 2)
+        self.head_chars = 0
+
+    def add(self, index, content):
+        with self.lock:
+            self.done[index] = content
+            while self.next_index in self.done:
+                content = self.done.pop(self.next_index)
+                if content is None:
+                    self.cut_head()
+                else:
+                    # Whatever was not streamed, e.g. a cached response
+                    self.emit(content[self.head_chars:] + '\n\n')
+                    self.flush()
+                self.finished(self.next_index, content)
+                self.next_index += 1
+                self.head_start = self.file.tell()
+                self.head_chars = 0
+                # The next chunk catches up on the text it received while waiting
+                for text in self.partial.pop(self.next_index, []):
+                    self.emit(text)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+def dispatch_chunks(prompts, call, limiter, writer, workers=4, output_tokens=4096, lookup=None):
+    # Sends every prompt through call(i, prompt) on a thread pool and hands results to writer in order.
+    # Each request reserves its estimated input plus the full output budget from the limiter;
+    # results found by lookup(i) are returned without a request
+    results = [None] * len(prompts)
+
+    def run(i):
+        cached = lookup(i) if lookup else None
+        if cached is not None:
+            return cached
+        return call_with_backoff(lambda prompt: call(i, prompt), prompts[i], limiter,
+                                 estimate_tokens(prompts[i]) + output_tokens, lambda: writer.restart(i))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(run, i): i for i in range(len(prompts))}
+        for future in concurrent.futures.as_completed(futures):
+            i = futures[future]
+            try:
+                results[i] = future.result()
+            except Exception as e:
+                logging.error(f"Error processing chunk {i+1}: {str(e)}")
+            writer.add(i, results[i])
+    return results
@@ -9,6 +9,17 @@ import chardet
 import sys
 import datetime
 import concurrent.futures
+import hashlib
+import time
+from dispatch import TokenBucket, OrderedWriter, chunk_transcript, dispatch_chunks
+from stub_client import StubBedrockClient
+from checkpoint import Checkpoint
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from result_cache import ResultCache, hash_text
+
+# Claude 3 Sonnet's output limit; input chunks are kept well below it so the rewritten text fits
+MAX_TOKENS = 4096
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', force=True)
@@ -42,7 +53,33 @@ def read_transcript(file_path):
         logging.error(f"Failed to decode file {file_path}. Please check the file encoding.")
         raise UnicodeDecodeError(f"Unable to decode the file with any known encoding.")
 
-def call_bedrock_api(client, model_id, prompt):
+def truncate_text(text, limit=600):
+    # Keeps the log bounded: the start and end of long prompts and responses
+    if len(text) > limit:
+        return f"{text[:limit // 2]}...{text[-(limit // 2):]}"
+    return text
+
+def read_stream(response, on_text):
+    # Anthropic message events: text arrives in content_block_delta, the output token count in
+    # message_delta. Errors raised mid-stream (e.g. throttling) propagate from the iteration
+    pieces = []
+    output_tokens = None
+    first_token = None
+    for event in response['body']:
+        if 'chunk' not in event:
+            continue
+        message = json.loads(event['chunk']['bytes'])
+        if message['type'] == 'content_block_delta' and message['delta'].get('type') == 'text_delta':
+            if first_token is None:
+                first_token = time.perf_counter()
+            pieces.append(message['delta']['text'])
+            on_text(message['delta']['text'])
+        elif message['type'] == 'message_delta':
+            output_tokens = message.get('usage', {}).get('output_tokens', output_tokens)
+    return "".join(pieces), output_tokens, first_token
+
+def call_bedrock_api(client, model_id, prompt, on_text=None):
+    # With on_text the response is streamed and on_text receives each piece of text as it arrives
     body = json.dumps({
         "messages": [
             {
@@ -51,41 +88,51 @@ def call_bedrock_api(client, model_id, prompt):
             }
         ],
         "anthropic_version": "bedrock-2023-05-31",
-        "max_tokens": 4096,
+        "max_tokens": MAX_TOKENS,
         "temperature": 1,
         "top_p": 0.999,
         "top_k": 200,
     })
 
     # Log truncated prompt body to console
-    if len(body) > 600:
-        truncated_body = f"{body[:300]}...{body[-300:]}"
-    else:
-        truncated_body = body
-    logging.info(f"Prompt body (truncated):\n{truncated_body}")
-
-    response = client.invoke_model(
-        body=body,
-        modelId=model_id,
-        accept='application/json',
-        contentType='application/json'
-    )
-
-    response_body = json.loads(response['body'].read())
-    content = response_body['content']
-
-    # Extract the 'text' from the content structure
-    if isinstance(content, list):
-        extracted_text = content[0]['text']
+    logging.info(f"Prompt body (truncated):\n{truncate_text(body)}")
+
+    start = time.perf_counter()
+    if on_text:
+        response = client.invoke_model_with_response_stream(
+            body=body,
+            modelId=model_id,
+            accept='application/json',
+            contentType='application/json'
+        )
+        extracted_text, output_tokens, first_token = read_stream(response, on_text)
     else:
-        extracted_text = str(content)  # Fallback to string representation if structure is unexpected
-
-    logging.info(f"Raw content structure: {content}")
-    logging.info(f"Extracted text: {extracted_text}")
-
-    print("API Response:")
-    print(extracted_text)
-    print("End of response.")
+        response = client.invoke_model(
+            body=body,
+            modelId=model_id,
+            accept='application/json',
+            contentType='application/json'
+        )
+
+        response_body = json.loads(response['body'].read())
+        content = response_body['content']
+
+        # Extract the 'text' from the content structure
+        if isinstance(content, list):
+            extracted_text = content[0]['text']
+        else:
+            extracted_text = str(content)  # Fallback to string representation if structure is unexpected
+        output_tokens = response_body.get('usage', {}).get('output_tokens')
+        first_token = None
+    end = time.perf_counter()
+
+    # Time to first token is the whole call when not streaming; tokens/s counts from the first token
+    ttft = (first_token or end) - start
+    generating = end - (first_token or start)
+    rate = f"{output_tokens / generating:.1f} tokens/s" if output_tokens and generating > 0 else "n/a tokens/s"
+    logging.info(f"Response: {len(extracted_text)} chars, {output_tokens} output tokens, "
+                 f"TTFT {ttft:.2f}s, {rate}, total {end - start:.2f}s")
+    logging.info(f"Response text (truncated):\n{truncate_text(extracted_text)}")
 
     return extracted_text  # Return only the extracted text content
 
@@ -130,38 +177,77 @@ The raw transcription is as below:
 
     return prompts.get(prompt_type, summary_prompt)
 
-def process_transcript(transcript, client, model_id, md_file, prompt_type, chunk_size=3000, overlap=300):
-    chunks = []
-    
-    for i in range(0, len(transcript), chunk_size - overlap):
-        chunk = transcript[i:i + chunk_size]
-        chunks.append(chunk)
-
-    results = []
+def response_version(model_id, prompt_type):
+    # Part of the response cache key: editing a prompt template changes its hash, so old
+    # responses are not reused for it
+    template = hashlib.blake2b(select_prompt(prompt_type).encode('utf-8'), digest_size=6).hexdigest()
+    return f"bedrock:{model_id}:{prompt_type}:{template}"
+
+def start_markdown(md_file, prompt_type):
+    # If the markdown file already exists, archive it with a timestamp
+    if os.path.exists(md_file):
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        archive_file = f"{os.path.splitext(md_file)[0]}_{prompt_type}_{timestamp}.md"
+        os.rename(md_file, archive_file)
+        logging.info(f"Archived existing file to: {archive_file}")
+
+    # Create a new markdown file
+    open(md_file, 'w').close()
+    logging.info(f"Created new markdown file: {md_file}")
+
+def process_transcript(transcript, client, model_id, md_file, prompt_type, limiter, chunk_tokens=2000, overlap_tokens=100, workers=4, cache=None, stream=False):
+    # Chunks are split at sentence ends by estimated tokens and sent concurrently; results are
+    # appended to the markdown in chunk order as soon as every earlier chunk is done, and with
+    # stream the earliest unfinished chunk is written as its tokens arrive
+    chunks = chunk_transcript(transcript, chunk_tokens, overlap_tokens)
     base_prompt = select_prompt(prompt_type)
+    version = response_version(model_id, prompt_type)
+    digests = [hash_text(chunk) for chunk in chunks]
+    logging.info(f"{prompt_type}: {len(chunks)} chunks of up to {chunk_tokens} tokens")
+
+    # An interrupted run over the same chunks continues after the last chunk it wrote
+    checkpoint = Checkpoint(md_file, hash_text("\n".join([version] + digests)))
+    done = checkpoint.resume()
+    if done:
+        print(f"Resuming {md_file} at chunk {done+1}/{len(chunks)}")
+    else:
+        start_markdown(md_file, prompt_type)
+    prompts = [base_prompt + chunk for chunk in chunks[done:]]
+    failed = False
+
+    def finished(i, content):
+        nonlocal failed
+        i += done
+        if content is None:
+            # Later chunks are still written, but the checkpoint stays before the failed one
+            failed = True
+            return
+        if not failed:
+            checkpoint.save(i + 1)
+        print(f"Chunk {i+1}/{len(chunks)} processed and written to {md_file}")
+
+    writer = OrderedWriter(md_file, finished)
+
+    def lookup(i):
+        return cache.lookup(digests[done + i], version) if cache else None
+
+    def call(i, prompt):
+        on_text = (lambda text: writer.text(i, text)) if stream else None
+        content = call_bedrock_api(client, model_id, prompt, on_text)
+        if cache:
+            cache.store(hash_text(prompt[len(base_prompt):]), version, content)
+        return content
+
+    results = dispatch_chunks(prompts, call, limiter, writer, workers, MAX_TOKENS, lookup)
+    writer.close()
+    if failed:
+        print(f"Some chunks failed; run again to resume {md_file} from the first missing chunk")
+    else:
+        checkpoint.remove()
+    return [content for content in results if content is not None]
 
-    for i, chunk in enumerate(chunks):
-        # Ensure chunk is a string
-        if isinstance(chunk, list):
-            chunk = ' '.join(chunk)
-        prompt = base_prompt + chunk
-        try:
-            content = call_bedrock_api(client, model_id, prompt)
-            results.append(content)
-            write_to_markdown(md_file, content)
-            print(f"Chunk {i+1}/{len(chunks)} processed and written to {md_file}")
-        except Exception as e:
-            logging.error(f"Error processing chunk {i+1}: {str(e)}")
-
-    return results
-
-def write_to_markdown(file_path, content):
-    with open(file_path, 'a', encoding='utf-8') as f:
-        f.write(content + '\n\n')
-    logging.info(f"Appended content to: {file_path}")
-
-def process_single_prompt(transcript, client, model_id, md_file, prompt_type, chunk_size, overlap):
-    results = process_transcript(transcript, client, model_id, md_file, prompt_type, chunk_size, overlap)
+def process_single_prompt(transcript, client, model_id, md_file, prompt_type, limiter, chunk_tokens, overlap_tokens, workers, cache, stream):
+    results = process_transcript(transcript, client, model_id, md_file, prompt_type, limiter, chunk_tokens, overlap_tokens, workers, cache, stream)
     print(f"All results for {prompt_type} have been processed and written to {md_file}")
     return results
 
@@ -169,6 +255,14 @@ def main():
     parser = argparse.ArgumentParser(description="Process meeting transcript using Bedrock API")
     parser.add_argument("--folder", required=True, help="Folder containing the transcript file (relative to Downloads)")
     parser.add_argument("--prompttype", required=True, help="Type(s) of prompt to use for processing (space-separated if multiple)")
+    parser.add_argument("--chunk-tokens", type=int, default=2000, help="Estimated tokens of transcript per request (default: 2000)")
+    parser.add_argument("--overlap-tokens", type=int, default=100, help="Tokens of the previous chunk repeated as context (default: 100)")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent requests per prompt type (default: 4)")
+    parser.add_argument("--tpm", type=int, default=100000, help="Tokens per minute allowed across all requests, input plus max output (default: 100000)")
+    parser.add_argument("--stream", action="store_true", help="Stream responses and append them to the markdown as they are generated")
+    parser.add_argument("--nocache", action="store_true", help="Send every chunk to Bedrock even if the same request was answered before")
+    parser.add_argument("--stub", type=float, nargs="?", const=0.0, metavar="THROTTLE_RATE",
+                        help="Use a local stub instead of bedrock-runtime, optionally throttling this fraction of calls")
     args = parser.parse_args()
 
     # Split the prompttype argument into a list
@@ -201,7 +295,16 @@ def main():
         region_name='us-east-1',  # Replace with your preferred region
         retries={'max_attempts': 3, 'mode': 'standard'}
     )
-    bedrock_client = boto3.client('bedrock-runtime', config=bedrock_config)
+    if args.stub is not None:
+        bedrock_client = StubBedrockClient(throttle_rate=args.stub)
+    else:
+        bedrock_client = boto3.client('bedrock-runtime', config=bedrock_config)
+
+    # Responses are cached by model, prompt type, template and chunk content across runs
+    cache = None if args.nocache else ResultCache()
+
+    # One limiter for every prompt type, since they share the model's quota
+    limiter = TokenBucket(args.tpm)
 
     model_id = 'anthropic.claude-3-sonnet-20240229-v1:0'  # Claude 3.5 Sonnet model ID
 
@@ -211,24 +314,16 @@ def main():
         for prompt_type in prompt_types:
             # Create the markdown file path with prompt type appended
             md_file = os.path.splitext(transcript_file)[0] + f'_{prompt_type}.md'
-            
-            # If the markdown file already exists, archive it with a timestamp
-            if os.path.exists(md_file):
-                timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-                archive_file = f"{os.path.splitext(md_file)[0]}_{prompt_type}_{timestamp}.md"
-                os.rename(md_file, archive_file)
-                logging.info(f"Archived existing file to: {archive_file}")
-
-            # Create a new markdown file
-            open(md_file, 'w').close()
-            logging.info(f"Created new markdown file: {md_file}")
-
-            future = executor.submit(process_single_prompt, transcript, bedrock_client, model_id, md_file, prompt_type, 999999999, 20)
+
+            future = executor.submit(process_single_prompt, transcript, bedrock_client, model_id, md_file, prompt_type, limiter,
+                                     args.chunk_tokens, args.overlap_tokens, args.workers, cache, args.stream)
             futures.append(future)
 
         # Wait for all tasks to complete
         concurrent.futures.wait(futures)
 
+    if cache is not None:
+        cache.close()
     print("All prompt types have been processed.")
 
 if __name__ == "__main__":
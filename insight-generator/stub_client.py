@@ -0,0 +1,72 @@
+import io
+import json
+import time
+import random
+import threading
+
+# Stands in for boto3's bedrock-runtime client (--stub): no AWS account, no cost. Responses echo the
+# prompt size after a delay, and a share of calls can be throttled to exercise the rate limiter
+
+class StubClientError(Exception):
+    # Same shape as botocore's ClientError, which is what the dispatcher inspects
+    def __init__(self, code, operation):
+        super().__init__(f"An error occurred ({code}) when calling the {operation} operation (stub)")
+        self.response = {"Error": {"Code": code, "Message": "stub"}}
+
+class StubBedrockClient:
+    def __init__(self, latency=1.0, throttle_rate=0.0, seed=None):
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.throttles = 0
+
+    def respond(self, body, operation, delay=True):
+        request = json.loads(body)
+        prompt = request["messages"][0]["content"]
+        with self.lock:
+            self.calls += 1
+            throttled = self.random.random() < self.throttle_rate
+            self.throttles += throttled
+        if throttled:
+            raise StubClientError("ThrottlingException", operation)
+        # A streamed response starts after a quarter of the latency and spreads the rest over its words
+        time.sleep(self.latency if delay else self.latency / 4)
+        # The last line of the prompt identifies the chunk in the output
+        tail = prompt.strip().splitlines()[-1][-60:] if prompt.strip() else ""
+        text = f"Stub response for a {len(prompt)} character prompt ending in: {tail}"
+        return request, text
+
+    def invoke_model_with_response_stream(self, body, modelId, accept='application/json', contentType='application/json'):
+        # Throttling is raised on the call; the text then arrives word by word in Anthropic's event format
+        request, text = self.respond(body, "InvokeModelWithResponseStream", delay=False)
+        return {"body": self.events(request, text), "contentType": contentType}
+
+    def events(self, request, text):
+        def event(message):
+            return {"chunk": {"bytes": json.dumps(message).encode('utf-8')}}
+
+        words = text.split(" ")
+        yield event({"type": "message_start", "message": {"usage": {"input_tokens": len(request["messages"][0]["content"]) // 4}}})
+        yield event({"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}})
+        for i, word in enumerate(words):
+            time.sleep(self.latency * 3 / 4 / len(words))
+            yield event({"type": "content_block_delta", "index": 0,
+                         "delta": {"type": "text_delta", "text": word if i == 0 else " " + word}})
+        yield event({"type": "content_block_stop", "index": 0})
+        yield event({"type": "message_delta", "delta": {"stop_reason": "end_turn"}, "usage": {"output_tokens": len(words)}})
+        yield event({"type": "message_stop"})
+
+    def invoke_model(self, body, modelId, accept='application/json', contentType='application/json'):
+        request, text = self.respond(body, "InvokeModel")
+        response = {
+            "id": "stub",
+            "model": modelId,
+            "type": "message",
+            "role": "assistant",
+            "content": [{"type": "text", "text": text}],
+            "stop_reason": "end_turn",
+            "usage": {"input_tokens": len(request["messages"][0]["content"]) // 4, "output_tokens": len(text) // 4},
+        }
+        return {"body": io.BytesIO(json.dumps(response).encode('utf-8')), "contentType": contentType}
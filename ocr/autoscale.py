@@ -0,0 +1,115 @@
+import os
+import logging
+import threading
+import psutil
+import GPUtil
+
+# Resource samples are taken every SAMPLE_INTERVAL seconds by one background thread instead of
+# after every image
+SAMPLE_INTERVAL = 5.0
+# Grow only while CPU has headroom, shrink when workers oversubscribe the cores and CPU is pegged
+CPU_LOW = 70.0
+CPU_HIGH = 95.0
+# Memory that must stay free after loading one more model copy
+MIN_FREE_MB = 1024
+# Model memory assumed per worker until the running workers can be measured
+WORKER_MEMORY_MB = 800
+# Samples to wait after a resize before the next one; a new worker spends seconds loading models
+COOLDOWN_SAMPLES = 2
+
+def probe_gpu():
+    # GPUtil shells out to nvidia-smi, so ask once at startup rather than on every sample
+    try:
+        return bool(GPUtil.getGPUs())
+    except Exception:
+        return False
+
+def worker_memory_mb():
+    # Resident memory of the worker processes (children of this process)
+    rss = 0
+    for child in psutil.Process(os.getpid()).children(recursive=True):
+        try:
+            rss += child.memory_info().rss
+        except psutil.Error:
+            continue
+    return rss / 1024 / 1024
+
+def sample(has_gpu):
+    gpu_usage = None
+    if has_gpu:
+        gpus = GPUtil.getGPUs()
+        gpu_usage = gpus[0].load * 100 if gpus else None
+    return {
+        # Non-blocking: CPU use since the previous sample
+        "cpu": psutil.cpu_percent(interval=None),
+        "free_mb": psutil.virtual_memory().available / 1024 / 1024,
+        "workers_mb": worker_memory_mb(),
+        "gpu": gpu_usage,
+    }
+
+class ConcurrencyController:
+    def __init__(self, engine, interval=SAMPLE_INTERVAL, min_free_mb=MIN_FREE_MB):
+        self.engine = engine
+        self.interval = interval
+        self.min_free_mb = min_free_mb
+        self.has_gpu = probe_gpu()
+        self.cooldown = 0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def decide(self, stats, backlog):
+        # Returns +1 to add a worker, -1 to retire one, 0 to keep the pool as it is
+        engine = self.engine
+        workers = engine.workers
+        per_worker_mb = stats["workers_mb"] / workers if workers and stats["workers_mb"] else WORKER_MEMORY_MB
+        oversubscribed = workers * engine.threads_per_worker > (os.cpu_count() or 1)
+
+        if stats["free_mb"] < self.min_free_mb and workers > engine.min_workers:
+            return -1
+        if stats["cpu"] > CPU_HIGH and oversubscribed and workers > engine.min_workers:
+            return -1
+        if (backlog > 0 and stats["cpu"] < CPU_LOW and workers < engine.max_workers
+                and stats["free_mb"] - per_worker_mb > self.min_free_mb):
+            return 1
+        if backlog == 0 and engine.in_flight() < workers and workers > engine.min_workers:
+            # Idle workers only hold memory
+            return -1
+        return 0
+
+    def step(self):
+        stats = sample(self.has_gpu)
+        backlog = self.engine.backlog_size()
+        change = 0
+        if self.cooldown > 0:
+            self.cooldown -= 1
+        else:
+            change = self.decide(stats, backlog)
+        if change > 0:
+            self.engine.add_worker()
+        elif change < 0:
+            self.engine.remove_worker()
+        if change:
+            self.cooldown = COOLDOWN_SAMPLES
+
+        gpu_usage = f"{stats['gpu']:.0f}%" if stats["gpu"] is not None else "N/A"
+        logging.info(f"CPU Usage: {stats['cpu']}% | Free Memory: {stats['free_mb']:.0f} MB | "
+                     f"Worker Memory: {stats['workers_mb']:.0f} MB | GPU Usage: {gpu_usage} | "
+                     f"Backlog: {backlog} | Workers: {self.engine.workers}"
+                     + (f" ({'+' if change > 0 else '-'}1)" if change else ""))
+
+    def run(self):
+        # The first cpu_percent call only sets the baseline
+        psutil.cpu_percent(interval=None)
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.step()
+            except Exception as e:
+                logging.info(f"Error sampling system usage: {e}")
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
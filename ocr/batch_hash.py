@@ -0,0 +1,95 @@
+import concurrent.futures
+import numpy as np
+from PIL import Image
+
+# Bumped whenever the hash computation changes, so cached hashes from older code are not compared
+# with new ones
+HASH_VERSION = 1
+ALGORITHMS = ("ahash", "dhash", "phash")
+# Frames are reduced to THUMBNAIL_SIZE x THUMBNAIL_SIZE grey levels in the workers; every hash is
+# computed from that stack
+THUMBNAIL_SIZE = 32
+HASH_SIZE = 8
+
+def load_thumbnail(path):
+    with Image.open(path) as image:
+        # JPEG decodes straight at a reduced scale; PNG has to be decoded fully, then reduce() box-filters
+        # it cheaply before the final resize
+        image.draft('L', (THUMBNAIL_SIZE * 4, THUMBNAIL_SIZE * 4))
+        image = image.convert('L')
+        factor = min(image.size) // (THUMBNAIL_SIZE * 4)
+        if factor > 1:
+            image = image.reduce(factor)
+        image = image.resize((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.BOX)
+        return np.asarray(image, dtype=np.uint8)
+
+def try_load_thumbnail(path):
+    try:
+        return load_thumbnail(path)
+    except Exception:
+        return None
+
+def load_thumbnails(paths, workers=4):
+    # Returns an (N, THUMBNAIL_SIZE, THUMBNAIL_SIZE) float32 stack of the readable files (None if there
+    # are none) and their positions in paths
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        thumbnails = list(executor.map(try_load_thumbnail, paths, chunksize=16))
+    ok = [i for i, thumbnail in enumerate(thumbnails) if thumbnail is not None]
+    stack = np.stack([thumbnails[i] for i in ok]).astype(np.float32) if ok else None
+    return stack, ok
+
+def box_matrix(size_in, size_out):
+    # (size_out, size_in) averaging weights, so resizing a stack is two matrix products
+    weights = np.zeros((size_out, size_in), dtype=np.float32)
+    for i in range(size_in):
+        weights[i * size_out // size_in, i] = 1
+    return weights / weights.sum(axis=1, keepdims=True)
+
+def dct_matrix(size):
+    # Orthonormal DCT-II basis, one row per frequency
+    n = np.arange(size)
+    matrix = np.cos(np.pi * (2 * n[None, :] + 1) * n[:, None] / (2 * size)) * np.sqrt(2 / size)
+    matrix[0] /= np.sqrt(2)
+    return matrix.astype(np.float32)
+
+def pack_bits(bits):
+    # (N, 8, 8) booleans, row-major and most significant bit first (same order as imagehash's hex)
+    packed = np.packbits(bits.reshape(len(bits), -1), axis=1)
+    return packed.view('>u8').ravel().astype(np.uint64)
+
+def hash_stack(stack, algorithm="ahash"):
+    rows = box_matrix(THUMBNAIL_SIZE, HASH_SIZE)
+    if algorithm == "ahash":
+        small = rows @ stack @ rows.T
+        bits = small > small.mean(axis=(1, 2), keepdims=True)
+    elif algorithm == "dhash":
+        # Brightness gradient between horizontally adjacent cells of a 9 x 8 grid
+        small = rows @ stack @ box_matrix(THUMBNAIL_SIZE, HASH_SIZE + 1).T
+        bits = small[:, :, 1:] > small[:, :, :-1]
+    elif algorithm == "phash":
+        dct = dct_matrix(THUMBNAIL_SIZE)
+        low = (dct @ stack @ dct.T)[:, :HASH_SIZE, :HASH_SIZE]
+        bits = low > np.median(low.reshape(len(low), -1), axis=1)[:, None, None]
+    else:
+        raise ValueError(f"Unknown hash algorithm: {algorithm}")
+    return pack_bits(bits)
+
+def hash_files(paths, algorithm="ahash", workers=4):
+    # Returns a list of int hashes, None for files that could not be decoded
+    stack, ok = load_thumbnails(paths, workers)
+    hashes = [None] * len(paths)
+    if stack is None:
+        return hashes
+    for i, value in zip(ok, hash_stack(stack, algorithm).tolist()):
+        hashes[i] = value
+    return hashes
+
+# Popcount of every byte value, for numpy versions without bitwise_count
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+def hamming_matrix(a, b):
+    # (len(a), len(b)) Hamming distances between two uint64 hash arrays
+    xor = np.asarray(a, dtype=np.uint64)[:, None] ^ np.asarray(b, dtype=np.uint64)[None, :]
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(xor)
+    return POPCOUNT[xor.view(np.uint8)].reshape(xor.shape + (8,)).sum(axis=-1, dtype=np.uint8)
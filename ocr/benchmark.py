@@ -0,0 +1,56 @@
+import os
+import time
+import logging
+import difflib
+from engine import init_worker, ocr_batch, lines_to_text, detect_boxes
+from image_io import read_image
+from regions import detect_adaptive
+
+# A reference set is a folder of screenshots; <name>.gt.txt next to a screenshot holds its expected
+# text. Without one, the full-frame OCR output is the reference for the other modes.
+GROUND_TRUTH_SUFFIX = ".gt.txt"
+MODES = [("full-frame", detect_boxes), ("adaptive", detect_adaptive)]
+
+def similarity(reference, text):
+    # Character-level, ignoring line breaks (the modes may split lines differently)
+    return difflib.SequenceMatcher(None, reference.replace("\n", ""), text.replace("\n", "")).ratio()
+
+def read_ground_truth(image_path):
+    try:
+        with open(os.path.splitext(image_path)[0] + GROUND_TRUTH_SUFFIX, 'r', encoding='utf-8') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+def run_benchmark(reference_dir, threads_per_worker=1):
+    image_paths = sorted(os.path.join(reference_dir, f) for f in os.listdir(reference_dir)
+                         if f.lower().endswith((".png", ".jpg", ".jpeg")))
+    pairs = [(path, image) for path, image in ((path, read_image(path)[1]) for path in image_paths)
+             if image is not None]
+    if not pairs:
+        logging.info(f"No readable screenshots found in {reference_dir}")
+        return
+
+    # One in-process model, warmed up so loading time is not counted against the first mode
+    init_worker(threads_per_worker)
+    ocr_batch([pairs[0][1]])
+
+    outputs = {}
+    timings = {}
+    for name, detect in MODES:
+        start = time.perf_counter()
+        outputs[name] = [lines_to_text(ocr_batch([image], detect)[0]) for path, image in pairs]
+        timings[name] = time.perf_counter() - start
+
+    references = []
+    for (path, image), baseline in zip(pairs, outputs["full-frame"]):
+        ground_truth = read_ground_truth(path)
+        references.append(ground_truth if ground_truth is not None else baseline)
+    with_ground_truth = sum(read_ground_truth(path) is not None for path, image in pairs)
+
+    logging.info(f"Benchmark on {len(pairs)} screenshots ({with_ground_truth} with ground truth)")
+    for name, detect in MODES:
+        scores = [similarity(reference, text) for reference, text in zip(references, outputs[name])]
+        logging.info(f"{name:>10}: {len(pairs) / timings[name]:.2f} images/s, "
+                     f"{timings[name] / len(pairs) * 1000:.0f} ms/image, mean similarity {sum(scores) / len(scores):.3f}, "
+                     f"worst {min(scores):.3f} ({os.path.basename(pairs[scores.index(min(scores))][0])})")
@@ -0,0 +1,273 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import cv2
+import numpy as np
+
+# The PaddleOCR instance owned by this worker process, loaded once by init_worker
+_ocr = None
+
+def init_worker(threads_per_worker=1, lang='ch', batch_size=6):
+    # Thread limits must be in place before Paddle spins up its pools
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads_per_worker)
+
+    from paddleocr import PaddleOCR
+    cv2.setNumThreads(threads_per_worker)
+
+    global _ocr
+    # batch_size text-line crops go through the classifier and recognizer per model call
+    _ocr = PaddleOCR(use_angle_cls=True, lang=lang, use_gpu=False, cpu_threads=threads_per_worker, show_log=False,
+                     rec_batch_num=batch_size, cls_batch_num=batch_size)
+    logging.info(f"OCR worker {os.getpid()} loaded models ({threads_per_worker} threads)")
+
+def get_ocr():
+    # Callers running outside a pool (e.g. a one-off script) get a lazily loaded model
+    if _ocr is None:
+        init_worker()
+    return _ocr
+
+def process_image(image_path, image=None):
+    # image is the already decoded screenshot; PaddleOCR only reads image_path itself when it is None
+    paddle_result = get_ocr().ocr(image_path if image is None else image, cls=True)
+
+    logging.info(f"OCR result for {image_path}: {paddle_result}")
+
+    if paddle_result is None or len(paddle_result) == 0 or paddle_result[0] is None:
+        return "No text detected in the image."
+
+    text = "\n".join([line[1][0] for result in paddle_result for line in result])
+    return text
+
+def crop_text_line(image, box):
+    # Perspective-crop one detected quadrilateral into an upright text-line image
+    box = np.array(box, dtype=np.float32)
+    width = int(max(np.linalg.norm(box[0] - box[1]), np.linalg.norm(box[2] - box[3])))
+    height = int(max(np.linalg.norm(box[0] - box[3]), np.linalg.norm(box[1] - box[2])))
+    target = np.float32([[0, 0], [width, 0], [width, height], [0, height]])
+    matrix = cv2.getPerspectiveTransform(box, target)
+    crop = cv2.warpPerspective(image, matrix, (width, height), borderMode=cv2.BORDER_REPLICATE, flags=cv2.INTER_CUBIC)
+    if height >= 1.5 * max(width, 1):
+        crop = np.rot90(crop)
+    return crop
+
+def sort_boxes(boxes, key=lambda box: box):
+    # Reading order: top to bottom, then left to right for boxes on the same line;
+    # key picks the box out of each item when sorting whole OCR lines
+    boxes = sorted(boxes, key=lambda b: (key(b)[0][1], key(b)[0][0]))
+    for i in range(len(boxes) - 1):
+        for j in range(i, -1, -1):
+            if abs(key(boxes[j + 1])[0][1] - key(boxes[j])[0][1]) < 10 and key(boxes[j + 1])[0][0] < key(boxes[j])[0][0]:
+                boxes[j], boxes[j + 1] = boxes[j + 1], boxes[j]
+            else:
+                break
+    return boxes
+
+def detect_boxes(image):
+    dt_boxes, _ = get_ocr().text_detector(image)
+    return [] if dt_boxes is None else sort_boxes(list(dt_boxes))
+
+def recognize_crops(crops):
+    # One classifier call and one recognizer call for all crops; Paddle splits them into batch_size chunks
+    if not crops:
+        return []
+    ocr = get_ocr()
+    if ocr.use_angle_cls:
+        crops, _, _ = ocr.text_classifier(crops)
+    rec_res, _ = ocr.text_recognizer(crops)
+    return rec_res
+
+def ocr_batch(images, detect=detect_boxes):
+    # Detection runs per image (the detector takes one image), recognition is batched across all images;
+    # detect is detect_boxes or another function returning full-frame boxes in reading order
+    image_boxes = []
+    crops = []
+    for image in images:
+        if image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        boxes = detect(image)
+        image_boxes.append(boxes)
+        crops.extend(crop_text_line(image, box) for box in boxes)
+
+    rec_res = recognize_crops(crops)
+
+    results = []
+    drop_score = get_ocr().drop_score
+    offset = 0
+    for boxes in image_boxes:
+        lines = rec_res[offset:offset + len(boxes)]
+        offset += len(boxes)
+        results.append([(box, (text, score)) for box, (text, score) in zip(boxes, lines) if score >= drop_score])
+    return results
+
+def lines_to_text(lines):
+    if not lines:
+        return "No text detected in the image."
+    return "\n".join(text for box, (text, score) in lines)
+
+def process_batch(image_paths, images=None, detect=detect_boxes):
+    # Returns one text per path; unreadable images are reported instead of failing the whole batch.
+    # images are the already decoded screenshots (None for unreadable ones), read from image_paths if omitted
+    if images is None:
+        images = [cv2.imread(image_path) for image_path in image_paths]
+    results = iter(ocr_batch([image for image in images if image is not None], detect))
+
+    texts = []
+    for image_path, image in zip(image_paths, images):
+        if image is None:
+            logging.info(f"Error reading image: {image_path}")
+            texts.append("No text detected in the image.")
+            continue
+        lines = next(results)
+        logging.info(f"OCR result for {image_path}: {len(lines)} lines")
+        texts.append(lines_to_text(lines))
+    return texts
+
+class WorkerSlot:
+    # One worker process with its own model; the pool grows and shrinks a slot at a time
+    def __init__(self, initargs):
+        self.executor = ProcessPoolExecutor(max_workers=1, initializer=init_worker, initargs=initargs)
+        self.in_flight = 0
+
+class OCREngine:
+    # Tasks wait in a shared backlog and are handed to a slot once it has fewer than PREFETCH
+    # tasks, so workers added later pick up queued work too
+    PREFETCH = 2
+
+    def __init__(self, workers=4, threads_per_worker=1, lang='ch', batch_size=6, min_workers=None, max_workers=None):
+        self.initargs = (threads_per_worker, lang, batch_size)
+        self.threads_per_worker = threads_per_worker
+        self.min_workers = min(min_workers or workers, workers)
+        self.max_workers = max(max_workers or workers, workers)
+        self.slots = []
+        self.retired = []
+        self.backlog = deque()
+        self.lock = threading.Lock()
+        self.completed = 0
+        self.started = time.monotonic()
+        for _ in range(workers):
+            self.add_worker()
+
+    @property
+    def workers(self):
+        return len(self.slots)
+
+    def add_worker(self):
+        with self.lock:
+            self.slots.append(WorkerSlot(self.initargs))
+        self.dispatch()
+
+    def remove_worker(self):
+        # The slot stops receiving work; tasks already handed to it still finish. Its executor is only
+        # shut down once it is idle (here or in finished), since dispatch may have picked the slot
+        # just before and not submitted yet
+        with self.lock:
+            if len(self.slots) <= 1:
+                return
+            slot = min(self.slots, key=lambda s: s.in_flight)
+            self.slots.remove(slot)
+            if slot.in_flight:
+                self.retired.append(slot)
+                return
+        slot.executor.shutdown(wait=False)
+
+    def backlog_size(self):
+        with self.lock:
+            return len(self.backlog)
+
+    def in_flight(self):
+        with self.lock:
+            return sum(slot.in_flight for slot in self.slots)
+
+    def submit(self, fn, *args, images=1):
+        # images is how many screenshots the task covers, for the throughput figures
+        future = Future()
+        with self.lock:
+            self.backlog.append((future, fn, args, images))
+        self.dispatch()
+        return future
+
+    def dispatch(self):
+        while True:
+            with self.lock:
+                if not self.backlog or not self.slots:
+                    return
+                slot = min(self.slots, key=lambda s: s.in_flight)
+                if slot.in_flight >= self.PREFETCH:
+                    return
+                task = self.backlog.popleft()
+                slot.in_flight += 1
+            future, fn, args, images = task
+            try:
+                inner = slot.executor.submit(fn, *args)
+            except BrokenProcessPool:
+                # The slot's process died after its last task; the task did not run, so it goes
+                # back to the front of the backlog for a fresh slot
+                with self.lock:
+                    slot.in_flight -= 1
+                    self.backlog.appendleft(task)
+                self.replace_worker(slot)
+                continue
+            except Exception as e:
+                # Anything else fails the task instead of leaving its future pending forever
+                with self.lock:
+                    slot.in_flight -= 1
+                future.set_exception(e)
+                continue
+            inner.add_done_callback(lambda f, slot=slot, future=future, images=images: self.finished(slot, future, f, images))
+
+    def replace_worker(self, slot):
+        # A worker killed (e.g. by the OOM killer) breaks its pool for good; a new slot takes its place
+        with self.lock:
+            if slot not in self.slots:
+                return
+            self.slots.remove(slot)
+            self.slots.append(WorkerSlot(self.initargs))
+        logging.warning("OCR worker process died, started a replacement")
+        slot.executor.shutdown(wait=False)
+
+    def finished(self, slot, future, inner, images):
+        with self.lock:
+            slot.in_flight -= 1
+            self.completed += images
+            idle_retired = slot in self.retired and not slot.in_flight
+            if idle_retired:
+                self.retired.remove(slot)
+        if idle_retired:
+            slot.executor.shutdown(wait=False)
+        error = inner.exception()
+        if isinstance(error, BrokenProcessPool):
+            self.replace_worker(slot)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(inner.result())
+        self.dispatch()
+
+    def images_per_second(self):
+        elapsed = time.monotonic() - self.started
+        return self.completed / elapsed if elapsed > 0 else 0.0
+
+    def report(self):
+        logging.info(f"OCR throughput: {self.completed} images in {time.monotonic() - self.started:.1f}s "
+                     f"({self.images_per_second():.2f} images/s, {self.workers} workers)")
+
+    def shutdown(self):
+        # Waits for the backlog to drain before the worker processes exit
+        while self.backlog_size() or self.in_flight():
+            time.sleep(0.1)
+        with self.lock:
+            slots, self.slots = self.slots + self.retired, []
+        for slot in slots:
+            slot.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.report()
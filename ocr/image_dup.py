@@ -1,57 +1,171 @@
 import os
 import send2trash
-from PIL import Image
-import imagehash
 from pathlib import Path
-import concurrent.futures
-from itertools import combinations
-import time
+from batch_hash import ALGORITHMS, HASH_VERSION, hash_files, hamming_matrix
+import json
 import logging
+import threading
+
+# Per-folder sidecar with the 64-bit perceptual hash of every screenshot, so each file is decoded and
+# hashed once; entries stay valid while the file's size and mtime are unchanged and the sidecar was
+# written by the same hash algorithm and version
+HASH_CACHE_FILENAME = ".image_hashes.json"
+# Up to this many frames per pass, duplicates are found from one vectorized Hamming distance
+# matrix; larger (e.g. --scope global) passes use the BK-tree
+MATRIX_LIMIT = 2048
+
+class HashCache:
+    def __init__(self, folder, algorithm="ahash"):
+        self.path = Path(folder) / HASH_CACHE_FILENAME
+        self.algorithm = algorithm
+        self.version = f"{algorithm}-v{HASH_VERSION}"
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.entries = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+            if isinstance(cached, dict) and cached.get("hash") == self.version:
+                # file name -> [size, mtime_ns, hash]
+                self.entries = cached["entries"]
+            else:
+                self.dirty = True
+        except (OSError, ValueError):
+            pass
+
+    def get(self, file):
+        file = Path(file)
+        stat = file.stat()
+        with self.lock:
+            entry = self.entries.get(file.name)
+        if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            return entry[2]
+        return None
+
+    def put(self, file, value):
+        stat = Path(file).stat()
+        with self.lock:
+            self.entries[Path(file).name] = [stat.st_size, stat.st_mtime_ns, value]
+            self.dirty = True
+
+    def save(self):
+        # Files trashed or renamed since are dropped from the sidecar
+        with self.lock:
+            names = {f.name for f in self.path.parent.iterdir()}
+            stale = [name for name in self.entries if name not in names]
+            for name in stale:
+                del self.entries[name]
+            if not self.dirty and not stale:
+                return
+            tmp_path = self.path.with_name(self.path.name + ".tmp")
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"hash": self.version, "entries": self.entries}, f, separators=(",", ":"))
+            os.replace(tmp_path, self.path)
+            self.dirty = False
+
+def fill_caches(files, caches, workers=4):
+    # Hash every file missing from its folder's cache in one batch: thumbnails are decoded in a
+    # process pool and hashed together as a NumPy stack
+    missing = [f for f in files if caches[f.parent].get(f) is None]
+    if not missing:
+        return
+    algorithm = next(iter(caches.values())).algorithm
+    logging.info(f"Hashing {len(missing)} new screenshots ({algorithm})")
+    for file, value in zip(missing, hash_files(missing, algorithm, workers)):
+        if value is None:
+            logging.info(f"Error hashing {file}")
+        else:
+            caches[file.parent].put(file, value)
+
+def hamming(hash1, hash2):
+    return (hash1 ^ hash2).bit_count()
+
+class BKTree:
+    # Metric tree over 64-bit hashes under Hamming distance. Children are keyed by their distance
+    # to the parent, so a radius query only descends into edges within radius of the query's
+    # distance to each node instead of comparing against every kept frame.
+    def __init__(self):
+        self.root = None
+
+    def add(self, value, item):
+        node = [value, item, {}]
+        if self.root is None:
+            self.root = node
+            return
+        current = self.root
+        while True:
+            distance = hamming(value, current[0])
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def find(self, value, radius):
+        # Returns the item of some node within radius, or None
+        if self.root is None:
+            return None
+        stack = [self.root]
+        while stack:
+            node_value, item, children = stack.pop()
+            distance = hamming(value, node_value)
+            if distance <= radius:
+                return item
+            stack.extend(child for edge, child in children.items() if abs(edge - distance) <= radius)
+        return None
 
-def are_images_similar(img1_path, img2_path, threshold=1):
+def remove_duplicate(file, original, debug):
     try:
-        hash1 = imagehash.average_hash(Image.open(img1_path))
-        hash2 = imagehash.average_hash(Image.open(img2_path))
-        return hash1 - hash2 < threshold
-    except FileNotFoundError:
-        logging.info(f"Warning: One of the files not found: {img1_path} or {img2_path}")
-        return False
+        if debug:
+            new_name = file.with_name(f"p_{file.name}")
+            file.rename(new_name)
+            logging.info(f"Debug mode: Renamed {file.name} to {new_name.name} (duplicate of {original.name})")
+        else:
+            send2trash.send2trash(str(file))
+            logging.info(f"Moved to trash: {file.name} (duplicate of {original.name})")
+        return True
     except Exception as e:
-        logging.info(f"Error comparing images: {e}")
+        logging.info(f"Error processing file: {e}")
         return False
 
-def compare_pair(pair, iteration):
-    if len(pair) == 1:
-        logging.info(f"Iteration {iteration}: Skipping single file {pair[0].name}")
-        return None
-    file1, file2 = pair
-    logging.info(f"Iteration {iteration}: Comparing {file1.name} and {file2.name}")
-    if are_images_similar(file1, file2):
-        return file2  # Return the second file to be deleted
-    return None
-
-def process_file(file, kept_files):
-    if not file.exists():
-        logging.info(f"Warning: File not found: {file}")
-        return
-
-    should_keep = True
-    if kept_files:
-        most_recent_kept = kept_files[-1]
-        if are_images_similar(file, most_recent_kept):
-            should_keep = False
-    
-    if should_keep:
-        kept_files.append(file)
-        logging.info(f"Kept: {file.name}")
+def screenshot_files(folder):
+    return [f for f in folder.glob("screenshot_*.png") if not f.name.startswith("p_")]
+
+def dedup_files(files, caches, threshold=1, debug=False):
+    # One pass, newest first (names carry the capture time): a frame within threshold - 1 bits
+    # of any kept frame, adjacent or not, is a duplicate; otherwise it is kept
+    hashed = [(f, caches[f.parent].get(f)) for f in sorted(files, key=lambda f: f.name, reverse=True)]
+    files = [f for f, value in hashed if value is not None]
+    hashes = [value for f, value in hashed if value is not None]
+
+    if len(files) <= MATRIX_LIMIT:
+        distances = hamming_matrix(hashes, hashes)
+        kept = []
+        def find_original(i, value):
+            if not kept:
+                return None
+            row = distances[i, kept]
+            nearest = int(row.argmin())
+            return files[kept[nearest]] if row[nearest] < threshold else None
+        def keep(i, value):
+            kept.append(i)
     else:
-        try:
-            send2trash.send2trash(str(file))
-            logging.info(f"Moved to trash: {file.name}")
-        except Exception as e:
-            logging.info(f"Error moving file to trash: {e}")
-
-def process_images(folder="", debug=False, workers=4):
+        tree = BKTree()
+        def find_original(i, value):
+            return tree.find(value, threshold - 1)
+        def keep(i, value):
+            tree.add(value, files[i])
+
+    removed = 0
+    for i, (file, value) in enumerate(zip(files, hashes)):
+        original = find_original(i, value)
+        if original is None:
+            keep(i, value)
+        elif remove_duplicate(file, original, debug):
+            removed += 1
+    return removed
+
+def process_images(folder="", debug=False, workers=4, threshold=1, scope="folder", algorithm="ahash"):
     downloads_folder = Path.home() / "Downloads"
 
     if folder:
@@ -76,92 +190,34 @@ def process_images(folder="", debug=False, workers=4):
 
     logging.info("Press Ctrl+C to stop the program.")
 
-    def process_folder(folder):
-        logging.info(f"Processing folder: {folder}")
-        iteration_number = 0
-
-        while True:
-            screenshot_files = sorted(
-                [f for f in folder.glob("screenshot_*.png") if not f.name.startswith("p_")],
-                key=lambda x: x.name,
-                reverse=True
-            )
-            
-            if len(screenshot_files) < 2:
-                logging.info(f"Not enough files to compare in {folder}. Moving to next folder.")
-                break
-
-            files_to_process = set()
-            
-            # Generate pairs based on neighboring positions
-            pairs = list(zip(screenshot_files[::2], screenshot_files[1::2]))
-            
-            # Handle the case of odd number of files
-            if len(screenshot_files) % 2 != 0:
-                pairs.append((screenshot_files[-1],))
-
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                results = executor.map(lambda p: compare_pair(p, iteration_number), pairs)
-                
-                for result in results:
-                    if result:
-                        files_to_process.add(result)
-            
-            for file in files_to_process:
-                try:
-                    if debug:
-                        new_name = file.with_name(f"p_{file.name}")
-                        file.rename(new_name)
-                        logging.info(f"Debug mode: Renamed {file.name} to {new_name.name}")
-                    else:
-                        send2trash.send2trash(str(file))
-                        logging.info(f"Moved to trash: {file.name}")
-                except Exception as e:
-                    logging.info(f"Error processing file: {e}")
-            
-            if files_to_process:
-                action = "Renamed" if debug else "Deleted"
-                logging.info(f"Iteration {iteration_number}: {action} {len(files_to_process)} files.")
-                iteration_number += 1
-                logging.info(f"Completed iteration {iteration_number}. Moving on to the next round!")
-            else:
-                logging.info(f"Iteration {iteration_number}: No duplicates found.")
-                logging.info("Switching to sequential comparison logic.")
-
-                # Sequential comparison logic
-                for i in range(len(screenshot_files) - 1):
-                    file1 = screenshot_files[i]
-                    file2 = screenshot_files[i + 1]
-                    logging.info(f"Sequential comparison: Comparing {file1.name} and {file2.name}")
-                    if are_images_similar(file1, file2):
-                        try:
-                            if debug:
-                                new_name = file2.with_name(f"p_{file2.name}")
-                                file2.rename(new_name)
-                                logging.info(f"Debug mode: Renamed {file2.name} to {new_name.name}")
-                            else:
-                                send2trash.send2trash(str(file2))
-                                logging.info(f"Moved to trash: {file2.name}")
-                        except Exception as e:
-                            logging.info(f"Error processing file: {e}")
-
-                logging.info("All iterations complete. Moving to next folder.")
-                break  # Exit the while loop to move to the next folder
-
-            time.sleep(1)  # Wait for 1 second before the next iteration
+    caches = {folder: HashCache(folder, algorithm) for folder in folders_to_process}
+    action = "Renamed" if debug else "Deleted"
 
     try:
-        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
-            executor.map(process_folder, folders_to_process)
+        files_by_folder = {folder: screenshot_files(folder) for folder in folders_to_process}
+        fill_caches([f for files in files_by_folder.values() for f in files], caches, workers)
+
+        if scope == "global":
+            # One pass across every folder, so revisiting a page in a later session is caught too
+            files = [f for files in files_by_folder.values() for f in files]
+            removed = dedup_files(files, caches, threshold, debug)
+            logging.info(f"{action} {removed} duplicates across {len(folders_to_process)} folders.")
+        else:
+            for folder, files in files_by_folder.items():
+                removed = dedup_files(files, caches, threshold, debug)
+                logging.info(f"{folder.name}: {action} {removed} duplicates.")
     except KeyboardInterrupt:
         logging.info("\nProgram stopped by user.")
+    finally:
+        for cache in caches.values():
+            cache.save()
 
     logging.info("All folders processed. Exiting program.")
 
 # This function can be called from another script
-def run_image_deduplication(folder="", debug=False, workers=4):
+def run_image_deduplication(folder="", debug=False, workers=4, threshold=1, scope="folder", algorithm="ahash"):
     logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-    process_images(folder, debug, workers)
+    process_images(folder, debug, workers, threshold, scope, algorithm)
 
 # If you want to run this script directly, you can use this:
 if __name__ == "__main__":
@@ -169,7 +225,11 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Process and deduplicate screenshot images in real-time.")
     parser.add_argument("--folder", default="", help="Subfolder name in Downloads to process")
     parser.add_argument("--debug", action="store_true", help="Run in debug mode: rename duplicates instead of deleting")
-    parser.add_argument("--workers", type=int, default=4, help="Number of concurrent workers")
+    parser.add_argument("--workers", type=int, default=4, help="Number of processes decoding screenshots for hashing")
+    parser.add_argument("--threshold", type=int, default=1, help="Frames whose hashes differ in fewer bits than this are duplicates (default: 1)")
+    parser.add_argument("--scope", choices=["folder", "global"], default="folder",
+                        help="Look for duplicates within each folder, or across all processed folders")
+    parser.add_argument("--hash", choices=ALGORITHMS, default="ahash", help="Perceptual hash to compare frames with (default: ahash)")
     args = parser.parse_args()
     
-    run_image_deduplication(args.folder, args.debug, args.workers)
+    run_image_deduplication(args.folder, args.debug, args.workers, args.threshold, args.scope, args.hash)
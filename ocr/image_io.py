@@ -0,0 +1,60 @@
+import os
+import shutil
+import logging
+import cv2
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ioctl number for a Linux reflink (btrfs, XFS, bcachefs): the new file shares the extents
+FICLONE = 0x40049409
+
+def read_image(path):
+    # One read of the file and one decode; the raw bytes are kept for writing the copy
+    data = np.fromfile(path, dtype=np.uint8)
+    image = cv2.imdecode(data, cv2.IMREAD_COLOR) if data.size else None
+    return data, image
+
+def reflink(source_path, tmp_path):
+    if fcntl is None:
+        raise OSError("reflinks not supported")
+    with open(source_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+def place_file(source_path, dest_path, data=None):
+    # Put the screenshot into tm_daily_ingest without copying bytes when the filesystem allows:
+    # a hardlink on the same volume, else a reflink, else write out the bytes already read
+    # (or copy the file when it was not read)
+    tmp_path = dest_path + ".tmp"
+    try:
+        os.link(source_path, tmp_path)
+    except OSError:
+        try:
+            reflink(source_path, tmp_path)
+        except OSError:
+            if data is None:
+                shutil.copyfile(source_path, tmp_path)
+            else:
+                data.tofile(tmp_path)
+        shutil.copystat(source_path, tmp_path)
+    os.replace(tmp_path, dest_path)
+
+def binarize_in_place(image):
+    # Grayscale + Otsu threshold, written back into the decoded BGR buffer (PaddleOCR wants
+    # three channels) so only one single-channel scratch image is allocated
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU, dst=gray)
+    cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR, dst=image)
+    return image
+
+def load_and_place(source_path, dest_path, preprocess=False):
+    data, image = read_image(source_path)
+    place_file(source_path, dest_path, data)
+    if image is None:
+        logging.info(f"Error reading image: {source_path}")
+    elif preprocess:
+        binarize_in_place(image)
+    return image
@@ -0,0 +1,130 @@
+import os
+import json
+import logging
+import cv2
+import numpy as np
+from engine import detect_boxes, crop_text_line, recognize_crops, sort_boxes, ocr_batch, get_ocr
+from image_io import read_image, binarize_in_place
+
+# Frames are compared in TILE_SIZE x TILE_SIZE tiles; a tile counts as changed when any pixel
+# differs by more than PIXEL_THRESHOLD grey levels (ignores compression noise)
+TILE_SIZE = 32
+PIXEL_THRESHOLD = 24
+# Below SKIP_FRACTION of changed tiles the previous text is reused as is, above FULL_FRACTION
+# (scrolling, tab switch) the whole frame is OCRed again
+SKIP_FRACTION = 0.005
+FULL_FRACTION = 0.5
+BOXES_SUFFIX = ".boxes.json"
+
+def boxes_path(image_path):
+    # Cached text boxes sit next to the OCR text file
+    return os.path.splitext(image_path)[0] + BOXES_SUFFIX
+
+def load_boxes(image_path):
+    try:
+        with open(boxes_path(image_path), 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return [(np.array(box, dtype=np.float32), (text, score)) for box, text, score in cached["lines"]]
+
+def save_boxes(image_path, lines):
+    tmp_path = boxes_path(image_path) + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({"lines": [[np.asarray(box).tolist(), text, float(score)] for box, (text, score) in lines]},
+                  f, ensure_ascii=False)
+    os.replace(tmp_path, boxes_path(image_path))
+
+def previous_frame(image_path):
+    # The latest earlier screenshot in the same folder that already has cached boxes
+    folder, name = os.path.split(image_path)
+    # One listdir instead of a stat per earlier image
+    files = os.listdir(folder)
+    boxed = {f for f in files if f.endswith(BOXES_SUFFIX)}
+    for f in sorted((f for f in files if f < name and f.endswith((".png", ".jpg"))), reverse=True):
+        if boxes_path(f) in boxed:
+            return os.path.join(folder, f)
+    return None
+
+def changed_tiles(previous, image):
+    # Boolean grid with one cell per tile
+    diff = cv2.absdiff(cv2.cvtColor(previous, cv2.COLOR_BGR2GRAY), cv2.cvtColor(image, cv2.COLOR_BGR2GRAY))
+    height, width = diff.shape
+    rows, cols = -(-height // TILE_SIZE), -(-width // TILE_SIZE)
+    padded = np.zeros((rows * TILE_SIZE, cols * TILE_SIZE), dtype=np.uint8)
+    padded[:height, :width] = diff
+    return padded.reshape(rows, TILE_SIZE, cols, TILE_SIZE).max(axis=(1, 3)) > PIXEL_THRESHOLD
+
+def box_rect(box):
+    xs, ys = box[:, 0], box[:, 1]
+    return int(xs.min()), int(ys.min()), int(np.ceil(xs.max())), int(np.ceil(ys.max()))
+
+def overlaps(a, b):
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+def union(a, b):
+    return min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])
+
+def changed_regions(mask, lines, width, height):
+    # Connected groups of changed tiles, grown until no cached text line straddles a region edge
+    # (a line is either kept whole or detected again whole) and merged so no two regions overlap
+    count, _, stats, _ = cv2.connectedComponentsWithStats(
+        cv2.dilate(mask.astype(np.uint8), np.ones((3, 3), np.uint8)), connectivity=8)
+    regions = [(x * TILE_SIZE, y * TILE_SIZE, (x + w) * TILE_SIZE, (y + h) * TILE_SIZE)
+               for x, y, w, h, _ in stats[1:count]]
+    line_rects = [box_rect(box) for box, _ in lines]
+
+    grown = True
+    while grown:
+        grown = False
+        i = 0
+        while i < len(regions):
+            region = regions[i]
+            for rect in line_rects:
+                if overlaps(region, rect) and union(region, rect) != region:
+                    region = union(region, rect)
+                    grown = True
+            for j in range(len(regions) - 1, i, -1):
+                if overlaps(region, regions[j]):
+                    region = union(region, regions.pop(j))
+                    grown = True
+            regions[i] = region
+            i += 1
+    return [(max(0, x0), max(0, y0), min(width, x1), min(height, y1)) for x0, y0, x1, y1 in regions]
+
+def incremental_ocr(image_path, image, preprocess=False, detect=detect_boxes):
+    # Returns (lines, mode) where mode is "full", "reused" or "partial"; with preprocess the
+    # previous frame is binarized too, so both sides of the diff look alike
+    previous_path = previous_frame(image_path)
+    previous = read_image(previous_path)[1] if previous_path else None
+    if previous is not None and preprocess:
+        binarize_in_place(previous)
+    if previous is None or previous.shape != image.shape:
+        return ocr_batch([image], detect)[0], "full"
+
+    lines = load_boxes(previous_path)
+    mask = changed_tiles(previous, image)
+    fraction = mask.mean()
+    if lines is None or fraction > FULL_FRACTION:
+        return ocr_batch([image], detect)[0], "full"
+    if fraction < SKIP_FRACTION:
+        return lines, "reused"
+
+    height, width = image.shape[:2]
+    regions = changed_regions(mask, lines, width, height)
+    kept = [line for line in lines if not any(overlaps(region, box_rect(line[0])) for region in regions)]
+
+    # Detect only inside the changed regions, then recognize every new crop in one batch
+    boxes = []
+    for x0, y0, x1, y1 in regions:
+        for box in detect(image[y0:y1, x0:x1]):
+            boxes.append(np.asarray(box, dtype=np.float32) + np.float32([x0, y0]))
+    rec_res = recognize_crops([crop_text_line(image, box) for box in boxes])
+
+    drop_score = get_ocr().drop_score
+    new_lines = [(box, (text, score)) for box, (text, score) in zip(boxes, rec_res) if score >= drop_score]
+    # Restore reading order across kept and new lines
+    merged = sort_boxes(kept + new_lines, key=lambda line: line[0])
+    logging.info(f"Incremental OCR for {os.path.basename(image_path)}: {fraction:.1%} of tiles changed, "
+                 f"{len(kept)} lines reused, {len(new_lines)} re-recognized in {len(regions)} regions")
+    return merged, "partial"
@@ -1,104 +1,198 @@
-import cv2
-import numpy as np
-from paddleocr import PaddleOCR
 import pytesseract
 import os
-import shutil
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import as_completed
 import argparse
-import psutil
-import GPUtil
 import logging
 import sys
+from functools import partial
+from engine import OCREngine, process_image, process_batch, lines_to_text, ocr_batch, detect_boxes
+from regions import detect_adaptive
+from benchmark import run_benchmark
+from incremental import incremental_ocr, save_boxes
+from watcher import append_to_journal, watch
+from image_io import load_and_place, place_file
+from autoscale import ConcurrencyController
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from result_cache import ResultCache
+
+# Part of the result cache key; bump when OCR output changes for the same screenshot and settings
+OCR_VERSION = "paddleocr-ch-1"
 
 # Set up logging to print to console
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', stream=sys.stdout)
 
-def preprocess_image(image):
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    denoised = cv2.fastNlMeansDenoising(gray)
-    thresh = cv2.threshold(denoised, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
-    return thresh
+def process_and_save(source_path, dest_path, tm_daily_ingest, incremental=False, preprocess=False, adaptive=False):
+    # Link image into tm_daily_ingest folder, replacing if it already exists; the screenshot is
+    # read and decoded once and every stage below works on that array
+    image = load_and_place(source_path, dest_path, preprocess)
 
-def process_image(image_path):
-    ocr = PaddleOCR(use_angle_cls=True, lang='ch', use_gpu=False)
-    paddle_result = ocr.ocr(image_path, cls=True)
-    
-    logging.info(f"OCR result for {image_path}: {paddle_result}")
-    
-    if paddle_result is None or len(paddle_result) == 0:
-        return "No text detected in the image."
-    
-    text = "\n".join([line[1][0] for result in paddle_result for line in result])
-    return text
-
-def log_system_usage():
-    # CPU usage
-    cpu_percent = psutil.cpu_percent()
-    
-    # Memory usage
-    process = psutil.Process(os.getpid())
-    memory_info = process.memory_info()
-    memory_usage = memory_info.rss / 1024 / 1024  # in MB
-    
-    # GPU usage
-    gpus = GPUtil.getGPUs()
-    gpu_usage = gpus[0].load * 100 if gpus else "N/A"
-    
-    logging.info(f"CPU Usage: {cpu_percent}% | Memory Usage: {memory_usage:.2f} MB | GPU Usage: {gpu_usage}%")
-
-def process_and_save(source_path, dest_path, tm_daily_ingest):
-    # Copy image to tm_daily_ingest folder, replacing if it already exists
-    shutil.copy2(source_path, dest_path)
-    
     # Process image and save OCR result
-    ocr_result = process_image(dest_path)
+    detect = detect_adaptive if adaptive else detect_boxes
+    if image is None:
+        ocr_result = "No text detected in the image."
+    elif incremental:
+        ocr_result = process_incremental(dest_path, image, preprocess, detect)
+    elif adaptive:
+        ocr_result = lines_to_text(ocr_batch([image], detect)[0])
+    else:
+        ocr_result = process_image(dest_path, image)
     base_name = os.path.splitext(os.path.basename(dest_path))[0]
     txt_path = os.path.join(tm_daily_ingest, base_name + ".txt")
     with open(txt_path, 'w', encoding='utf-8') as f:
         f.write(ocr_result)
 
     logging.info(f"Processed: {os.path.basename(dest_path)}")
-    log_system_usage()
+    return [txt_path]
+
+def process_incremental(image_path, image, preprocess=False, detect=detect_boxes):
+    # Diff against the previous frame of the session and only OCR the regions that changed
+    lines, mode = incremental_ocr(image_path, image, preprocess, detect)
+    # A reused frame gets no boxes of its own, so the next frame is diffed against the last
+    # OCRed one and small changes cannot pile up unnoticed over many frames
+    if mode != "reused":
+        save_boxes(image_path, lines)
+    logging.info(f"OCR result for {image_path} ({mode}): {len(lines)} lines")
+    return lines_to_text(lines)
+
+def process_and_save_batch(pairs, tm_daily_ingest, preprocess=False, adaptive=False):
+    # Batched path: place and decode every image first, then OCR the whole batch with shared model calls
+    images = [load_and_place(source_path, dest_path, preprocess) for source_path, dest_path in pairs]
 
-def main(max_workers):
+    dest_paths = [dest_path for source_path, dest_path in pairs]
+    txt_paths = []
+    for dest_path, ocr_result in zip(dest_paths, process_batch(dest_paths, images, detect_adaptive if adaptive else detect_boxes)):
+        base_name = os.path.splitext(os.path.basename(dest_path))[0]
+        txt_path = os.path.join(tm_daily_ingest, base_name + ".txt")
+        with open(txt_path, 'w', encoding='utf-8') as f:
+            f.write(ocr_result)
+        txt_paths.append(txt_path)
+
+    logging.info(f"Processed batch of {len(pairs)}: {os.path.basename(dest_paths[0])} .. {os.path.basename(dest_paths[-1])}")
+    return txt_paths
+
+def ocr_version(incremental=False, preprocess=False, adaptive=False):
+    return f"{OCR_VERSION}:incremental={int(incremental)}:preprocess={int(preprocess)}:adaptive={int(adaptive)}"
+
+def restore_cached(cache, version, source_path, dest_path, tm_daily_ingest):
+    # True when the screenshot needs no OCR: the same content was OCRed before with the same settings
+    # (the text is restored for a renamed or copied screenshot), or its .txt predates the cache and
+    # is newer than the screenshot
+    txt_path = os.path.splitext(dest_path)[0] + ".txt"
+    text = cache.get(source_path, version)
+    if text is None:
+        if os.path.exists(txt_path) and os.path.getmtime(txt_path) >= os.path.getmtime(source_path):
+            with open(txt_path, 'r', encoding='utf-8') as f:
+                cache.put(source_path, version, f.read())
+            return True
+        return False
+
+    # Written again when missing or older than the screenshot (edited back to content seen before)
+    if not os.path.exists(txt_path) or os.path.getmtime(txt_path) < os.path.getmtime(source_path):
+        place_file(source_path, dest_path)
+        with open(txt_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        append_to_journal(tm_daily_ingest, txt_path)
+        logging.info(f"Restored from cache: {os.path.basename(dest_path)}")
+    return True
+
+def record_result(cache, version, source_path, txt_path):
+    with open(txt_path, 'r', encoding='utf-8') as f:
+        cache.put(source_path, version, f.read())
+
+def main(max_workers, threads_per_worker=1, batch_size=1, watch_mode=False, queue_size=64, poll_interval=2.0,
+         incremental=False, preprocess=False, min_workers=None, max_workers_limit=None, adaptive=False):
     # 1. Create tm_daily_ingest folder
     downloads_folder = os.path.expanduser("~/Downloads")
     tm_daily_ingest = os.path.join(downloads_folder, "tm_daily_ingest")
     os.makedirs(tm_daily_ingest, exist_ok=True)
 
-    # 2. Search for images in Desktop folder
     desktop_folder = os.path.expanduser("~/Desktop")
+
+    # Results are looked up by screenshot content, so renamed or copied screenshots are not OCRed
+    # again and edited ones are
+    cache = ResultCache()
+    version = ocr_version(incremental, preprocess, adaptive)
+
+    if watch_mode:
+        # Daemon: OCR screenshots as they land on the Desktop or in fooRound session folders
+        with OCREngine(max_workers, threads_per_worker, min_workers=min_workers, max_workers=max_workers_limit) as engine:
+            controller = ConcurrencyController(engine).start()
+            task = partial(process_and_save, incremental=incremental, preprocess=preprocess, adaptive=adaptive)
+            watch(engine, task, desktop_folder, downloads_folder, tm_daily_ingest, queue_size, poll_interval,
+                  skip=lambda path, dest_path: restore_cached(cache, version, path, dest_path, tm_daily_ingest),
+                  record=lambda path, txt_path: record_result(cache, version, path, txt_path))
+            controller.stop()
+        cache.close()
+        return
+
+    # 2. Search for images in Desktop folder
     screenshot_files = [f for f in os.listdir(desktop_folder) if f.startswith("Screenshot")]
     
     # 3. Filter out already processed files
     to_process = []
     for screenshot in screenshot_files:
-        base_name = os.path.splitext(screenshot)[0]
-        if not os.path.exists(os.path.join(tm_daily_ingest, base_name + ".txt")):
+        if not restore_cached(cache, version, os.path.join(desktop_folder, screenshot),
+                              os.path.join(tm_daily_ingest, screenshot), tm_daily_ingest):
             to_process.append(screenshot)
 
     # Sort files by creation time
     to_process.sort(key=lambda x: os.path.getctime(os.path.join(desktop_folder, x)))
 
-    # 4. Process files in parallel
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = []
-        for screenshot in to_process:
-            source_path = os.path.join(desktop_folder, screenshot)
-            dest_path = os.path.join(tm_daily_ingest, screenshot)
-            futures.append(executor.submit(process_and_save, source_path, dest_path, tm_daily_ingest))
+    # 4. Process files in parallel; each worker process loads the OCR models once
+    # Recognition batches are never smaller than PaddleOCR's default of 6 crops
+    # The pool grows and shrinks between min_workers and max_workers_limit with load and free memory
+    with OCREngine(max_workers, threads_per_worker, batch_size=max(batch_size, 6),
+                   min_workers=min_workers, max_workers=max_workers_limit) as engine:
+        controller = ConcurrencyController(engine).start()
+        futures = {}
+        pairs = [(os.path.join(desktop_folder, screenshot), os.path.join(tm_daily_ingest, screenshot))
+                 for screenshot in to_process]
+        if batch_size > 1 and not incremental:
+            for i in range(0, len(pairs), batch_size):
+                batch = pairs[i:i + batch_size]
+                future = engine.submit(process_and_save_batch, batch, tm_daily_ingest, preprocess, adaptive,
+                                       images=len(batch))
+                futures[future] = [source_path for source_path, dest_path in batch]
+        else:
+            for source_path, dest_path in pairs:
+                # With --incremental each frame is diffed against the latest earlier frame already OCRed
+                future = engine.submit(process_and_save, source_path, dest_path, tm_daily_ingest,
+                                       incremental, preprocess, adaptive)
+                futures[future] = [source_path]
 
         # Wait for all tasks to complete
         for future in as_completed(futures):
-            future.result()  # This will raise any exceptions that occurred during processing
+            # This will raise any exceptions that occurred during processing
+            for source_path, txt_path in zip(futures[future], future.result()):
+                append_to_journal(tm_daily_ingest, txt_path)
+                record_result(cache, version, source_path, txt_path)
+            logging.info(f"Throughput: {engine.images_per_second():.2f} images/s")
+        controller.stop()
 
+    cache.close()
     logging.info("All files processed.")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Process images with OCR")
-    parser.add_argument("--workers", type=int, default=4, help="Number of worker threads (default: 4)")
+    parser.add_argument("--workers", type=int, default=4, help="Number of OCR worker processes to start with (default: 4)")
+    parser.add_argument("--min-workers", type=int, help="Fewest OCR worker processes the pool may shrink to (default: --workers)")
+    parser.add_argument("--max-workers", type=int, help="Most OCR worker processes the pool may grow to (default: --workers)")
+    parser.add_argument("--threads", type=int, default=1, help="CPU threads per worker process (default: 1)")
+    parser.add_argument("--batch-size", type=int, default=1, help="Images per batched OCR call; 1 processes images one at a time (default: 1)")
+    parser.add_argument("--watch", action="store_true", help="Keep running and OCR new screenshots as they are captured")
+    parser.add_argument("--queue-size", type=int, default=64, help="Maximum screenshots waiting for OCR in --watch mode (default: 64)")
+    parser.add_argument("--incremental", action="store_true", help="Only OCR the regions that changed since the previous screenshot of the same session")
+    parser.add_argument("--preprocess", action="store_true", help="Binarize screenshots (grayscale + Otsu threshold) before OCR")
+    parser.add_argument("--adaptive", action="store_true", help="Detect text only in non-blank regions, downscaled to a target text height")
+    parser.add_argument("--benchmark", metavar="DIR", help="Compare full-frame and --adaptive OCR on the screenshots in DIR and exit")
+    parser.add_argument("--poll-interval", type=float, default=2.0, help="Seconds between folder polls when watchdog is unavailable (default: 2)")
     args = parser.parse_args()
 
-    main(args.workers)
+    if args.benchmark:
+        run_benchmark(args.benchmark, args.threads)
+        sys.exit(0)
+
+    main(args.workers, args.threads, args.batch_size, args.watch, args.queue_size, args.poll_interval,
+         args.incremental, args.preprocess, args.min_workers, args.max_workers, args.adaptive)
@@ -0,0 +1,85 @@
+import cv2
+import numpy as np
+from engine import detect_boxes, sort_boxes
+from incremental import overlaps, union
+
+# Text regions are located on a copy downscaled to ANALYSIS_WIDTH; only those regions reach the
+# detector, each scaled so its text is about TARGET_TEXT_HEIGHT pixels tall. PaddleOCR shrinks
+# whole frames to 960px on the long side before detection, which makes HiDPI text too small,
+# while blank margins, photos and UI chrome cost detector time for nothing.
+ANALYSIS_WIDTH = 960
+TARGET_TEXT_HEIGHT = 32
+# Gradient below this is treated as flat background, even if Otsu picks a lower threshold
+MIN_GRADIENT = 24
+REGION_MARGIN = 8
+# Past this share of the frame, cropping saves nothing and the frame is detected whole
+FULL_FRAME_FRACTION = 0.6
+
+def blob_rects(mask, kernel_size):
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, kernel_size))
+    count, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    return [(x, y, x + w, y + h) for x, y, w, h, _ in stats[1:count]]
+
+def merge_overlapping(rects):
+    # So no part of the frame is detected twice
+    rects = list(rects)
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(rects)):
+            for j in range(i + 1, len(rects)):
+                if overlaps(rects[i], rects[j]):
+                    rects[i] = union(rects[i], rects.pop(j))
+                    merged = True
+                    break
+            if merged:
+                break
+    return rects
+
+def find_text_regions(image):
+    # Returns (regions in full-resolution pixels, estimated text height in pixels or None)
+    height, width = image.shape[:2]
+    scale = min(1.0, ANALYSIS_WIDTH / width)
+    small = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else image
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+    # Morphological gradient is strong on glyph strokes and zero on flat backgrounds
+    gradient = cv2.morphologyEx(gray, cv2.MORPH_GRADIENT, np.ones((3, 3), np.uint8))
+    otsu, _ = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    _, edges = cv2.threshold(gradient, max(otsu, MIN_GRADIENT), 255, cv2.THRESH_BINARY)
+
+    # Characters close up into line blobs; their median height estimates the text size
+    lines = [rect for rect in blob_rects(edges, (9, 1)) if rect[2] - rect[0] > rect[3] - rect[1] >= 2]
+    text_height = float(np.median([y1 - y0 for x0, y0, x1, y1 in lines])) / scale if lines else None
+
+    # Lines close up further into blocks, which become the detection regions
+    margin = REGION_MARGIN
+    regions = []
+    for x0, y0, x1, y1 in blob_rects(edges, (25, 9)):
+        if x1 - x0 < 4 or y1 - y0 < 3:
+            continue
+        regions.append((max(0, int(x0 / scale) - margin), max(0, int(y0 / scale) - margin),
+                        min(width, int(x1 / scale) + margin), min(height, int(y1 / scale) + margin)))
+
+    return merge_overlapping(regions), text_height
+
+def detect_adaptive(image):
+    # Drop-in replacement for engine.detect_boxes: boxes in full-resolution coordinates
+    height, width = image.shape[:2]
+    regions, text_height = find_text_regions(image)
+    if not regions:
+        return []
+
+    scale = min(1.0, TARGET_TEXT_HEIGHT / text_height) if text_height else 1.0
+    area = sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in regions)
+    if area > FULL_FRAME_FRACTION * width * height:
+        regions = [(0, 0, width, height)]
+
+    boxes = []
+    for x0, y0, x1, y1 in regions:
+        crop = image[y0:y1, x0:x1]
+        if scale < 1.0:
+            crop = cv2.resize(crop, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        for box in detect_boxes(crop):
+            boxes.append(np.asarray(box, dtype=np.float32) / scale + np.float32([x0, y0]))
+    return sort_boxes(boxes)
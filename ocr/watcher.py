@@ -0,0 +1,250 @@
+import os
+import re
+import time
+import queue
+import logging
+import threading
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    # Without watchdog (inotify on Linux, FSEvents on macOS) the folders are polled instead
+    Observer = None
+    FileSystemEventHandler = object
+
+# Processed OCR files are appended here so the indexer picks them up without rescanning everything
+INDEX_DIRNAME = ".tm_index"
+JOURNAL_FILENAME = "pending.txt"
+# Keyframes whisperer --screenshots extracts from recordings into <session>/screenshots
+KEYFRAME_DIRNAME = "screenshots"
+KEYFRAME_RE = re.compile(r".+_screenshot_\d+\.jpg$")
+# Editing a file in place does not change its folder's mtime, so the poller lists every folder
+# again once in this many passes
+FULL_SCAN_EVERY = 15
+
+def is_screenshot(path, desktop_folder):
+    name = os.path.basename(path)
+    if os.path.dirname(path) == desktop_folder:
+        return name.startswith("Screenshot")
+    # fooRound session folders under Downloads
+    if os.path.basename(os.path.dirname(path)) == KEYFRAME_DIRNAME:
+        return bool(KEYFRAME_RE.match(name))
+    return name.startswith("screenshot_") and name.endswith(".png")
+
+def destination(path, desktop_folder, tm_daily_ingest):
+    # Desktop screenshots go straight into tm_daily_ingest, session screenshots into a
+    # subfolder named after the session so the indexer's folder-name boost still applies
+    if os.path.dirname(path) == desktop_folder:
+        return os.path.join(tm_daily_ingest, os.path.basename(path))
+    session_folder = os.path.dirname(path)
+    if os.path.basename(session_folder) == KEYFRAME_DIRNAME:
+        session_folder = os.path.dirname(session_folder)
+    session = os.path.basename(session_folder)
+    return os.path.join(tm_daily_ingest, session, os.path.basename(path))
+
+def is_processed(path, dest_path):
+    # Up to date when the .txt is at least as new as the screenshot; an edited screenshot is offered
+    # again and the result cache decides whether it needs OCR
+    try:
+        return os.path.getmtime(os.path.splitext(dest_path)[0] + ".txt") >= os.path.getmtime(path)
+    except OSError:
+        return False
+
+def append_to_journal(tm_daily_ingest, txt_path):
+    journal_dir = os.path.join(tm_daily_ingest, INDEX_DIRNAME)
+    os.makedirs(journal_dir, exist_ok=True)
+    with open(os.path.join(journal_dir, JOURNAL_FILENAME), 'a', encoding='utf-8') as f:
+        f.write(txt_path + "\n")
+
+def session_folders(downloads_folder):
+    folders = [entry.path for entry in os.scandir(downloads_folder)
+               if entry.is_dir() and "tm_daily_ingest" not in entry.name]
+    keyframe_folders = [os.path.join(folder, KEYFRAME_DIRNAME) for folder in folders]
+    return folders + [folder for folder in keyframe_folders if os.path.isdir(folder)]
+
+def wait_until_stable(path, interval=0.5, attempts=10):
+    # Screenshots are often still being written when they first show up
+    last_size = -1
+    for _ in range(attempts):
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return False
+        if size == last_size and size > 0:
+            return True
+        last_size = size
+        time.sleep(interval)
+    return True
+
+class IngestQueue:
+    # Bounded queue of screenshots waiting for OCR; put() blocks when full, which slows the
+    # watcher down instead of letting a burst of captures pile up in memory
+    def __init__(self, maxsize):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.pending = set()
+        self.lock = threading.Lock()
+
+    def put(self, path):
+        with self.lock:
+            if path in self.pending:
+                return
+            self.pending.add(path)
+        self.queue.put(path)
+
+    def get(self, timeout=None):
+        return self.queue.get(timeout=timeout)
+
+    def done(self, path):
+        with self.lock:
+            self.pending.discard(path)
+
+    def qsize(self):
+        return self.queue.qsize()
+
+class ScreenshotHandler(FileSystemEventHandler):
+    def __init__(self, ingest_queue, desktop_folder, tm_daily_ingest):
+        self.ingest_queue = ingest_queue
+        self.desktop_folder = desktop_folder
+        self.tm_daily_ingest = tm_daily_ingest
+
+    def offer(self, path):
+        if path.startswith(self.tm_daily_ingest) or not is_screenshot(path, self.desktop_folder):
+            return
+        if not is_processed(path, destination(path, self.desktop_folder, self.tm_daily_ingest)):
+            self.ingest_queue.put(path)
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.offer(event.src_path)
+
+    def on_modified(self, event):
+        # Screenshots edited in place (annotated, cropped) are OCRed again
+        if not event.is_directory:
+            self.offer(event.src_path)
+
+    def on_moved(self, event):
+        # Chrome downloads and macOS screenshots are renamed into place once complete
+        if not event.is_directory:
+            self.offer(event.dest_path)
+
+def scan_folder(folder, handler, seen):
+    # seen maps paths to the mtime they were offered at, so files changed since are offered again
+    for entry in os.scandir(folder):
+        if not entry.is_file():
+            continue
+        try:
+            mtime = entry.stat().st_mtime_ns
+        except OSError:
+            continue
+        if seen.get(entry.path) != mtime:
+            seen[entry.path] = mtime
+            handler.offer(entry.path)
+
+def poll_folders(handler, desktop_folder, downloads_folder, interval, stop_event):
+    # Fallback watcher: only folders whose mtime changed are listed again, apart from a periodic full pass
+    folder_mtimes = {}
+    seen = {}
+    passes = 0
+    while not stop_event.is_set():
+        full_scan = passes % FULL_SCAN_EVERY == 0
+        passes += 1
+        for folder in [desktop_folder] + session_folders(downloads_folder):
+            try:
+                mtime = os.stat(folder).st_mtime
+            except OSError:
+                continue
+            if full_scan or folder_mtimes.get(folder) != mtime:
+                folder_mtimes[folder] = mtime
+                scan_folder(folder, handler, seen)
+        stop_event.wait(interval)
+
+def dispatch(ingest_queue, engine, task, desktop_folder, tm_daily_ingest, max_in_flight, stop_event,
+             skip=None, record=None):
+    # Moves screenshots from the queue into the OCR engine, keeping at most max_in_flight in the pool.
+    # skip(path, dest_path) returns True when no OCR is needed (e.g. a cached result was restored);
+    # record(path, txt_path) is called for every finished OCR
+    in_flight = threading.Semaphore(max_in_flight)
+
+    def finished(path, txt_path, future):
+        in_flight.release()
+        ingest_queue.done(path)
+        try:
+            future.result()
+        except Exception as e:
+            logging.info(f"Error processing {path}: {e}")
+            return
+        append_to_journal(tm_daily_ingest, txt_path)
+        if record is not None:
+            record(path, txt_path)
+        logging.info(f"Queued for indexing: {txt_path} | {ingest_queue.qsize()} waiting | "
+                     f"{engine.images_per_second():.2f} images/s")
+
+    while not stop_event.is_set():
+        try:
+            path = ingest_queue.get(timeout=1)
+        except queue.Empty:
+            continue
+        # One bad screenshot (e.g. removed by the dedup tool while queued) must not stop the thread
+        acquired = False
+        try:
+            if not wait_until_stable(path):
+                ingest_queue.done(path)
+                continue
+
+            dest_path = destination(path, desktop_folder, tm_daily_ingest)
+            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+            txt_path = os.path.splitext(dest_path)[0] + ".txt"
+            if skip is not None and skip(path, dest_path):
+                ingest_queue.done(path)
+                continue
+
+            in_flight.acquire()
+            acquired = True
+            future = engine.submit(task, path, dest_path, os.path.dirname(dest_path))
+        except Exception as e:
+            logging.info(f"Error processing {path}: {e}")
+            if acquired:
+                in_flight.release()
+            ingest_queue.done(path)
+            continue
+        future.add_done_callback(lambda f, path=path, txt_path=txt_path: finished(path, txt_path, f))
+
+def watch(engine, task, desktop_folder, downloads_folder, tm_daily_ingest, queue_size=64, poll_interval=2.0,
+          skip=None, record=None):
+    ingest_queue = IngestQueue(queue_size)
+    handler = ScreenshotHandler(ingest_queue, desktop_folder, tm_daily_ingest)
+    stop_event = threading.Event()
+
+    dispatcher = threading.Thread(target=dispatch, daemon=True,
+                                  args=(ingest_queue, engine, task, desktop_folder, tm_daily_ingest,
+                                        engine.max_workers * 2, stop_event, skip, record))
+    dispatcher.start()
+
+    observer = None
+    if Observer is not None:
+        observer = Observer()
+        observer.schedule(handler, desktop_folder, recursive=False)
+        # Recursive so session folders created later are covered; tm_daily_ingest is filtered out in offer()
+        observer.schedule(handler, downloads_folder, recursive=True)
+        observer.start()
+        logging.info(f"Watching {desktop_folder} and {downloads_folder} for new screenshots")
+        # Catch up on anything captured while the daemon was not running
+        for folder in [desktop_folder] + session_folders(downloads_folder):
+            scan_folder(folder, handler, {})
+    else:
+        logging.info(f"watchdog not installed, polling {desktop_folder} and {downloads_folder} every {poll_interval}s")
+        poller = threading.Thread(target=poll_folders, daemon=True,
+                                  args=(handler, desktop_folder, downloads_folder, poll_interval, stop_event))
+        poller.start()
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        logging.info("Watch mode stopped by user.")
+    finally:
+        stop_event.set()
+        if observer is not None:
+            observer.stop()
+            observer.join()
@@ -0,0 +1,133 @@
+import os
+import ssl
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+SAMPLE_RATE = 16000
+# Energy VAD: 30 ms frames count as speech when louder than the noise floor (10th percentile of
+# frame levels) by SPEECH_MARGIN_DB, and never below MIN_SPEECH_DB. The floor assumes there is some
+# silence, so the threshold is also capped at LOUD_MARGIN_DB below the loud frames (90th percentile):
+# in continuous speech the 10th percentile is speech itself
+FRAME_MS = 30
+SPEECH_MARGIN_DB = 12
+MIN_SPEECH_DB = -50
+LOUD_MARGIN_DB = 20
+# If less than this share of the frames above MIN_SPEECH_DB counts as speech, the floor estimate is
+# off and the whole recording is transcribed instead
+MIN_SPEECH_SHARE = 0.1
+# Pauses shorter than MIN_SILENCE are kept inside speech; blips shorter than MIN_SPEECH are dropped
+MIN_SILENCE = 0.8
+MIN_SPEECH = 0.25
+PADDING = 0.2
+# Chunks end at a pause and are kept below MAX_CHUNK seconds; a pause longer than LONG_PAUSE always
+# ends a chunk, so long silences are never sent to Whisper
+MAX_CHUNK = 300
+LONG_PAUSE = 2.0
+
+_model = None
+
+def frame_levels(audio):
+    # RMS level per frame in dBFS
+    frame_length = SAMPLE_RATE * FRAME_MS // 1000
+    frames = audio[:len(audio) // frame_length * frame_length].reshape(-1, frame_length)
+    # einsum avoids a squared copy of hours of audio
+    rms = np.sqrt(np.einsum('ij,ij->i', frames, frames) / frame_length)
+    return 20 * np.log10(np.maximum(rms, 1e-10))
+
+def speech_regions(audio):
+    # Returns [(start, end)] in seconds
+    levels = frame_levels(audio)
+    if not len(levels):
+        return []
+    floor, loud = np.percentile(levels, [10, 90])
+    threshold = max(min(floor + SPEECH_MARGIN_DB, loud - LOUD_MARGIN_DB), MIN_SPEECH_DB)
+    speech = levels > threshold
+    duration = len(audio) / SAMPLE_RATE
+    audible = np.count_nonzero(levels > MIN_SPEECH_DB)
+    if audible and np.count_nonzero(speech) < audible * MIN_SPEECH_SHARE:
+        return [(0.0, duration)]
+
+    frame_seconds = FRAME_MS / 1000
+    # Edges of runs of speech frames
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], speech.astype(np.int8), [0]))))
+    regions = []
+    for start, end in zip(edges[::2] * frame_seconds, edges[1::2] * frame_seconds):
+        if regions and start - regions[-1][1] < MIN_SILENCE:
+            regions[-1][1] = end
+        else:
+            regions.append([start, end])
+
+    regions = [(max(0.0, start - PADDING), min(duration, end + PADDING))
+               for start, end in regions if end - start >= MIN_SPEECH]
+    # Audible audio always gets transcribed, even if only blips were found
+    return regions or ([(0.0, duration)] if audible else [])
+
+def quietest_point(audio, start, end):
+    # Split point for speech running past MAX_CHUNK without a pause: the quietest frame in its last 20 s
+    window_start = max(start, end - 20)
+    levels = frame_levels(audio[int(window_start * SAMPLE_RATE):int(end * SAMPLE_RATE)])
+    return window_start + int(np.argmin(levels)) * FRAME_MS / 1000 if len(levels) else end
+
+def plan_chunks(audio, regions):
+    # Groups speech regions into contiguous chunks split at pauses
+    chunks = []
+    for start, end in regions:
+        if chunks and start - chunks[-1][1] < LONG_PAUSE and end - chunks[-1][0] <= MAX_CHUNK:
+            chunks[-1][1] = end
+            continue
+        while end - start > MAX_CHUNK:
+            split = quietest_point(audio, start, start + MAX_CHUNK)
+            chunks.append([start, split])
+            start = split
+        chunks.append([start, end])
+    return chunks
+
+def init_worker(model_name, threads):
+    import torch
+    import whisper
+    torch.set_num_threads(threads)
+    ssl._create_default_https_context = ssl._create_unverified_context
+    global _model
+    _model = whisper.load_model(model_name)
+
+def transcribe_chunk(offset, samples):
+    # Timestamps are shifted from chunk-relative to recording-relative
+    result = _model.transcribe(samples)
+    segments = [dict(segment, start=segment["start"] + offset, end=segment["end"] + offset)
+                for segment in result["segments"]]
+    return {"text": result["text"].strip(), "segments": segments, "language": result.get("language")}
+
+class LongformTranscriber:
+    # Same transcribe(audio) interface as a Whisper model: silence is skipped and the speech chunks
+    # are transcribed on a pool of processes, each holding its own model
+    def __init__(self, model_name="medium", workers=None):
+        self.workers = workers or max(1, (os.cpu_count() or 1) // 4)
+        threads = max(1, (os.cpu_count() or 1) // self.workers)
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker,
+                                            initargs=(model_name, threads))
+
+    def transcribe(self, audio):
+        regions = speech_regions(audio)
+        chunks = plan_chunks(audio, regions)
+        speech = sum(end - start for start, end in chunks)
+        print(f"VAD: {speech:.0f}s of speech in {len(chunks)} chunks, "
+              f"{len(audio) / SAMPLE_RATE - speech:.0f}s of silence skipped")
+
+        # Longest chunks first so the pool is not left waiting on one long tail chunk
+        order = sorted(range(len(chunks)), key=lambda i: chunks[i][0] - chunks[i][1])
+        futures = {i: self.executor.submit(transcribe_chunk, chunks[i][0],
+                                           audio[int(chunks[i][0] * SAMPLE_RATE):int(chunks[i][1] * SAMPLE_RATE)])
+                   for i in order}
+        results = [futures[i].result() for i in range(len(chunks))]
+
+        segments = [segment for result in results for segment in result["segments"]]
+        languages = Counter(result["language"] for result in results if result["language"])
+        return {
+            "text": " ".join(result["text"] for result in results if result["text"]),
+            "segments": segments,
+            "language": languages.most_common(1)[0][0] if languages else None,
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
@@ -1,65 +1,223 @@
 import whisper
-import ffmpeg
 import os
 import argparse
 import ssl
 from pathlib import Path
 import subprocess
 import json
+import time
+import wave
+import queue
+import threading
+import re
+import sys
+import glob
+import tempfile
+import numpy as np
+from longform import LongformTranscriber
 
-def convert_media_to_wav(input_file, output_file):
-    stream = ffmpeg.input(input_file)
-    stream = ffmpeg.output(stream, output_file, acodec='pcm_s16le', ar='16000')
-    ffmpeg.run(stream)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from result_cache import ResultCache
 
-def extract_screenshots(input_path):
-    probe = ffmpeg.probe(input_path)
-    video_stream = next((stream for stream in probe['streams'] if stream['codec_type'] == 'video'), None)
-    
-    if video_stream is None:
-        print(f"No video stream found in {input_path}")
-        return
+# Part of the result cache key; bump when transcripts change for the same recording and settings
+TRANSCRIPT_VERSION = 1
 
-    # Try to get duration, use a default if not available
-    duration = get_video_duration(input_path)
-    if duration == 0:
-        print(f"Warning: Couldn't determine video duration for {input_path}")
-        # You might want to set a default duration or handle this case differently
-        return
+# Whisper works on 16 kHz mono float32 audio; ffmpeg output is read in CHUNK_SECONDS pieces
+SAMPLE_RATE = 16000
+CHUNK_SECONDS = 30
+# pts_time of every frame in ffmpeg's showinfo log
+SHOWINFO_PTS_RE = re.compile(r"Parsed_showinfo.*? pts_time:\s*([0-9.]+)")
 
-    # Extract screenshots
-    for i in range(0, int(duration), 10):
-        output_file = Path(input_path).parent / "screenshots" / f"{Path(input_path).stem}_screenshot_{i:04d}.jpg"
-        subprocess.run([
-            'ffmpeg', '-i', str(input_path), '-ss', str(i),
-            '-vframes', '1', str(output_file)
-        ], check=True)
+def decode_audio(input_file, duration=0):
+    # ffmpeg decodes to raw s16le on a pipe, converted chunk by chunk into one float32 buffer
+    # (sized from the probed duration, grown if that was short) without any file on disk.
+    # stderr goes to a temporary file: a damaged recording can log more decode errors than a pipe
+    # holds, which would block ffmpeg while this loop waits on stdout
+    stderr_file = tempfile.TemporaryFile()
+    process = subprocess.Popen(['ffmpeg', '-nostdin', '-loglevel', 'error', '-i', str(input_file), '-vn',
+                                '-f', 's16le', '-acodec', 'pcm_s16le', '-ac', '1', '-ar', str(SAMPLE_RATE), '-'],
+                               stdout=subprocess.PIPE, stderr=stderr_file)
+    audio = np.empty(int(duration * SAMPLE_RATE) + SAMPLE_RATE, dtype=np.float32)
+    length = 0
+    chunk_bytes = CHUNK_SECONDS * SAMPLE_RATE * 2
+    while True:
+        data = process.stdout.read(chunk_bytes)
+        if not data:
+            break
+        samples = np.frombuffer(data[:len(data) // 2 * 2], dtype=np.int16)
+        if length + len(samples) > len(audio):
+            audio = np.resize(audio, max(len(audio) * 2, length + len(samples)))
+        np.multiply(samples, 1 / 32768, out=audio[length:length + len(samples)], casting='unsafe')
+        length += len(samples)
 
-def process_file(input_media):
-    input_path = Path(input_media)
-    output_wav = input_path.with_suffix('.wav')
+    returncode = process.wait()
+    with stderr_file:
+        stderr_file.seek(0)
+        stderr = stderr_file.read()
+    if returncode != 0:
+        # The last lines name the actual failure
+        raise RuntimeError(f"ffmpeg failed on {input_file}: {stderr.decode(errors='replace').strip()[-2000:]}")
+    return audio[:length]
 
-    # Convert media to WAV
-    convert_media_to_wav(str(input_path), str(output_wav))
+def write_wav(audio, output_file):
+    with wave.open(str(output_file), 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes((np.clip(audio, -1, 1) * 32767).astype(np.int16).tobytes())
 
-    # # Extract screenshots if it's an MP4 file
-    # if input_path.suffix.lower() == '.mp4':
-    #     extract_screenshots(str(input_path))
+def has_screenshots(input_path):
+    input_path = Path(input_path)
+    return any((input_path.parent / "screenshots").glob(f"{glob.escape(input_path.stem)}_screenshot_*.jpg"))
 
-    # Transcribe the audio
+def extract_screenshots(input_path, interval=10, scene_threshold=None):
+    # One ffmpeg pass over the video: keep a frame every interval seconds (or only on scene
+    # changes), drop frames mpdecimate finds identical to the previous kept one, and log each
+    # kept frame's timestamp through showinfo
+    input_path = Path(input_path)
+    output_dir = input_path.parent / "screenshots"
+    output_dir.mkdir(exist_ok=True)
+
+    if scene_threshold:
+        sampler = f"select='gt(scene,{scene_threshold})'"
+    else:
+        sampler = f"fps=1/{interval}"
+    frame_pattern = output_dir / f".{input_path.stem}_frame_%06d.jpg"
+    result = subprocess.run([
+        'ffmpeg', '-nostdin', '-hide_banner', '-i', str(input_path), '-an',
+        '-vf', f"{sampler},mpdecimate,showinfo", '-vsync', 'vfr', '-q:v', '2', str(frame_pattern)
+    ], capture_output=True, text=True)
+    if result.returncode != 0:
+        print(f"Error extracting screenshots from {input_path}: {result.stderr.strip()[-500:]}")
+        return []
+
+    # Frames are numbered in output order, the same order showinfo reports them in
+    timestamps = [float(match) for match in SHOWINFO_PTS_RE.findall(result.stderr)]
+    screenshots = []
+    for number, pts_time in enumerate(timestamps, 1):
+        frame = Path(str(frame_pattern) % number)
+        if not frame.exists():
+            continue
+        # Millisecond names: in --scene mode several keyframes can fall within the same second
+        output_file = output_dir / f"{input_path.stem}_screenshot_{round(pts_time * 1000):08d}.jpg"
+        os.replace(frame, output_file)
+        screenshots.append(output_file)
+    print(f"Extracted {len(screenshots)} screenshots from {input_path.name} into {output_dir}")
+    return screenshots
+
+def extract_missing_screenshots(input_path, screenshots):
+    # screenshots is (interval, scene threshold), or None to skip. Keyframes from an earlier run are
+    # kept; only MP4 recordings without any are decoded again
+    if screenshots and input_path.suffix.lower() == '.mp4' and not has_screenshots(input_path):
+        extract_screenshots(input_path, *screenshots)
+
+def trim_segments(result):
+    return [
+        {"start": round(segment["start"], 2), "end": round(segment["end"], 2), "text": segment["text"]}
+        for segment in result["segments"]
+    ]
+
+def write_segments(input_path, result):
+    output_json = input_path.with_name(f"{input_path.stem}_segments.json")
+    segments = trim_segments(result)
+    # Written aside and renamed so the indexer never reads a half-written file
+    tmp_json = output_json.with_name(output_json.name + ".tmp")
+    with open(tmp_json, "w", encoding="utf-8") as f:
+        json.dump({"media": input_path.name, "language": result.get("language"), "segments": segments},
+                  f, ensure_ascii=False, indent=1)
+    os.replace(tmp_json, output_json)
+    return output_json
+
+def load_model(model_name="medium"):
     ssl._create_default_https_context = ssl._create_unverified_context
-    model = whisper.load_model("medium")
-    result = model.transcribe(str(output_wav))
+    return whisper.load_model(model_name)
+
+def prepare_audio(input_path, keep_wav=False, screenshots=None):
+    # Decode the media's audio into memory; returns the samples and the duration in seconds.
+    # screenshots is (interval, scene threshold) to also extract keyframes for OCR
+    audio = decode_audio(input_path, get_video_duration(input_path))
+    extract_missing_screenshots(input_path, screenshots)
+
+    if keep_wav:
+        output_wav = input_path.with_suffix('.wav')
+        write_wav(audio, output_wav)
+        print(f"WAV file saved to: {output_wav}")
+    return audio, len(audio) / SAMPLE_RATE
 
+def transcript_version(model_name, longform=False):
+    return f"whisper-{model_name}:{'longform' if longform else 'full'}:{TRANSCRIPT_VERSION}"
+
+def save_transcript(input_path, result):
     # Write transcription to file
     output_txt = input_path.with_name(f"{input_path.stem}_transcription.txt")
     with open(output_txt, "w", encoding="utf-8") as f:
         f.write(result["text"])
 
+    # Keep Whisper's segment timings so the indexer can jump to the matching moment
+    output_segments = write_segments(input_path, result)
+
     print(f"Transcription saved to: {output_txt}")
-    print(f"WAV file saved to: {output_wav}")
+    print(f"Segments saved to: {output_segments}")
+
+def restore_cached(input_path, cache, version, screenshots=None):
+    # A recording with the same content was transcribed before with the same model and mode
+    cached = cache.get(input_path, version)
+    if cached is None:
+        return False
+    print(f"Using cached transcript for {input_path.name}")
+    save_transcript(input_path, json.loads(cached))
+    extract_missing_screenshots(input_path, screenshots)
+    return True
+
+def process_file(input_media, model=None, prepared=None, keep_wav=False, screenshots=None, cache=None, version=None):
+    # prepared is (audio, duration) when the audio was already decoded by the producer thread
+    input_path = Path(input_media)
+    audio, duration = prepared or prepare_audio(input_path, keep_wav, screenshots)
+
+    # Transcribe the audio
+    if model is None:
+        model = load_model()
+    start = time.perf_counter()
+    result = model.transcribe(audio)
+    elapsed = time.perf_counter() - start
 
-    # The line that deletes the WAV file has been removed
+    save_transcript(input_path, result)
+    if cache is not None:
+        cache.put(input_path, version, json.dumps(
+            {"text": result["text"], "language": result.get("language"), "segments": trim_segments(result)},
+            ensure_ascii=False))
+    # Real-time factor: transcription time per second of audio (below 1 is faster than real time)
+    rtf = elapsed / duration if duration else 0.0
+    print(f"Transcribed {duration:.0f}s of audio in {elapsed:.0f}s (real-time factor {rtf:.2f})")
+
+def audio_producer(media_files, audio_queue, keep_wav=False, screenshots=None):
+    # Decodes audio for the upcoming files while the current one is being transcribed; the bounded
+    # queue keeps it at most a few files (and their decoded samples) ahead
+    for media_file in media_files:
+        try:
+            audio_queue.put((media_file, prepare_audio(media_file, keep_wav, screenshots), None))
+        except Exception as e:
+            audio_queue.put((media_file, None, e))
+    audio_queue.put(None)
+
+def process_files(media_files, model, prefetch=2, keep_wav=False, screenshots=None, cache=None, version=None):
+    # Directory mode: one model for every file, audio extraction pipelined with transcription.
+    # Recordings already in the cache are restored up front and never decoded
+    if cache is not None:
+        media_files = [f for f in media_files if not restore_cached(f, cache, version, screenshots)]
+    audio_queue = queue.Queue(maxsize=prefetch)
+    producer = threading.Thread(target=audio_producer, args=(media_files, audio_queue, keep_wav, screenshots), daemon=True)
+    producer.start()
+
+    while True:
+        item = audio_queue.get()
+        if item is None:
+            break
+        media_file, prepared, error = item
+        if error is not None:
+            print(f"Error extracting audio from {media_file}: {error}")
+            continue
+        process_file(str(media_file), model, prepared, keep_wav, cache=cache, version=version)
 
 def get_video_duration(input_path):
     try:
@@ -114,6 +272,15 @@ def main():
     parser = argparse.ArgumentParser(description="Transcribe WebM and MP4 audio files to text.")
     parser.add_argument("--path", help="Path to the input media file or directory")
     parser.add_argument("--folder", help="Folder name under Downloads to process")
+    parser.add_argument("--model", default="medium", help="Whisper model to load once for all files (default: medium)")
+    parser.add_argument("--keepwav", action="store_true", help="Also save the decoded 16 kHz audio as a .wav next to each recording")
+    parser.add_argument("--longform", action="store_true", help="Skip silence and transcribe speech chunks in parallel, one model per worker process")
+    parser.add_argument("--workers", type=int, help="Worker processes for --longform (default: a quarter of the CPU cores)")
+    parser.add_argument("--screenshots", action="store_true", help="Also extract keyframes from MP4 recordings into a screenshots folder for OCR")
+    parser.add_argument("--interval", type=int, default=10, help="Seconds between extracted keyframes (default: 10)")
+    parser.add_argument("--scene", type=float, help="Extract a keyframe only on scene changes above this score (0-1) instead of every --interval seconds")
+    parser.add_argument("--nocache", action="store_true", help="Transcribe every recording even if the same content was transcribed before")
+    parser.add_argument("--prefetch", type=int, default=2, help="Files whose audio is extracted ahead of transcription (default: 2)")
     args = parser.parse_args()
 
     if args.folder:
@@ -128,6 +295,17 @@ def main():
         print("Error: Either --path or --folder must be provided.")
         return
 
+    cache = None if args.nocache else ResultCache()
+    version = transcript_version(args.model, args.longform)
+    if cache is not None and input_path.is_file() and restore_cached(input_path, cache, version,
+                                                                     (args.interval, args.scene) if args.screenshots else None):
+        return
+
+    # Either model has transcribe(audio); the long-form one runs a process pool
+    model = LongformTranscriber(args.model, args.workers) if args.longform else load_model(args.model)
+
+    screenshots = (args.interval, args.scene) if args.screenshots else None
+
     if input_path.is_dir():
         # Get all WebM and MP4 files in the directory, sorted by size (large to small)
         media_files = sorted(
@@ -135,11 +313,10 @@ def main():
             key=lambda x: x.stat().st_size,
             reverse=True
         )
-        for media_file in media_files:
-            process_file(str(media_file))
+        process_files(media_files, model, args.prefetch, args.keepwav, screenshots, cache, version)
     elif input_path.is_file() and input_path.suffix.lower() in ('.webm', '.mp4'):
         # Process a single WebM or MP4 file
-        process_file(str(input_path))
+        process_file(str(input_path), model, keep_wav=args.keepwav, screenshots=screenshots, cache=cache, version=version)
     else:
         print(f"Error: {input_path} is not a valid WebM or MP4 file or directory containing such files.")
 